@@ -0,0 +1,231 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+"""Reports how much each plugin and module contributes to the size of the
+output files, to help decide what is worth loading dynamically."""
+
+import gzip
+import cgi
+from cStringIO import StringIO
+
+from dryice.path import path
+from dryice.sourcemap import SourceMap
+
+try:
+    from json import loads, dumps
+except ImportError:
+    from simplejson import loads, dumps
+
+def gzip_size(data):
+    """Returns the size of data once gzipped."""
+    if isinstance(data, unicode):
+        data = data.encode("utf8")
+    out = StringIO()
+    gz = gzip.GzipFile("", "wb", 9, out)
+    gz.write(data)
+    gz.close()
+    return len(out.getvalue())
+
+def source_sizes(smap, text):
+    """Returns a dictionary of how many characters of text, the generated
+    file that smap describes, came from each of the sources. Characters
+    that aren't mapped aren't counted."""
+    sizes = {}
+    lines = text.split("\n")
+    for line_number, segments in enumerate(smap.lines):
+        if line_number >= len(lines):
+            break
+        segments = sorted(segments)
+        for i, segment in enumerate(segments):
+            if i + 1 < len(segments):
+                end = segments[i + 1][0]
+            else:
+                end = len(lines[line_number])
+            source = smap.sources[segment[1]]
+            sizes[source] = sizes.get(source, 0) + max(end - segment[0], 0)
+    return sizes
+
+def _entry(name, raw, gzipped, compressed):
+    return dict(name=name, raw=raw, gzip=gzipped, compressed=compressed)
+
+def _by_size(entries):
+    entries.sort(key=lambda entry: (-entry["raw"], entry["name"]))
+    return entries
+
+def analyze(manifest):
+    """Returns the size report for a manifest that has been built. The
+    report has an entry for each JavaScript output file, which has one for
+    each package in it, which has one for each module. Each entry has the
+    raw size, the gzipped size and the size after compression with the
+    Closure Compiler, which is None unless the output has been compressed
+    with source maps turned on. Entries are sorted biggest first."""
+    output_dir = manifest.output_dir
+    layout = manifest.output_layout()
+    combined = manifest._combined
+    if combined is None:
+        # the plugins were combined straight into the output files, so
+        # combine them again to measure them
+        combined = manifest._combine_plugins([ package.name
+            for filename, packages in layout for package in packages ])
+    files = []
+    for filename, packages in layout:
+        f = output_dir / filename
+        uncompressed = path(f.splitext()[0] + ".uncompressed.js")
+        if uncompressed.exists():
+            compressed_data = f.bytes()
+            sizes = None
+            if (f + ".map").exists():
+                smap = SourceMap.from_json(loads((f + ".map").text("utf8")))
+                sizes = source_sizes(smap, compressed_data)
+            compressed_size = len(compressed_data)
+        else:
+            uncompressed = f
+            sizes = None
+            compressed_size = None
+
+        package_entries = []
+        for package in packages:
+            js, css, segments = combined[package.name]
+            module_entries = []
+            package_compressed = 0 if sizes is not None else None
+            for source, source_file, line, count in segments:
+                data = path(source_file).bytes()
+                module_compressed = None
+                if sizes is not None:
+                    module_compressed = sizes.get(source, 0)
+                    package_compressed += module_compressed
+                module_entries.append(_entry(source, len(data),
+                    gzip_size(data), module_compressed))
+            entry = _entry(package.name, len(js.encode("utf8")),
+                           gzip_size(js), package_compressed)
+            entry["modules"] = _by_size(module_entries)
+            package_entries.append(entry)
+
+        data = uncompressed.bytes()
+        entry = _entry(filename, len(data), gzip_size(data),
+                       compressed_size)
+        entry["packages"] = _by_size(package_entries)
+        files.append(entry)
+    return dict(files=_by_size(files))
+
+_html_template = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>dryice size report</title>
+<style>
+body { font-family: sans-serif; font-size: 12px; }
+.map { display: flex; height: 600px; margin-bottom: 20px; }
+.map div { display: flex; overflow: hidden; border: 1px solid #fff;
+    box-sizing: border-box; background: #8ab; }
+.map .depth1 { background: #7c9; }
+.map .depth2 { background: #db7; }
+.map span { padding: 2px; color: #222; white-space: nowrap; }
+table { border-collapse: collapse; }
+td, th { padding: 2px 8px; text-align: right; }
+td.name, th.name { text-align: left; }
+tr.file td { font-weight: bold; border-top: 1px solid #888; }
+tr.module td.name { padding-left: 24px; }
+</style>
+</head>
+<body>
+<h1>dryice size report</h1>
+<p>Areas are proportional to raw size. Hover for details.</p>
+%s
+<table>
+<tr><th class="name">name</th><th>raw</th><th>gzip</th><th>compressed</th></tr>
+%s
+</table>
+</body>
+</html>
+"""
+
+def _describe(entry):
+    text = "%s: %s bytes, %s gzipped" % (entry["name"], entry["raw"],
+                                        entry["gzip"])
+    if entry["compressed"] is not None:
+        text += ", %s compressed" % entry["compressed"]
+    return text
+
+def _treemap(entries, depth, children_keys):
+    """Nested flex boxes, alternating between rows and columns, sized by
+    raw bytes (a slice-and-dice treemap)."""
+    result = []
+    direction = depth % 2 and "column" or "row"
+    for entry in entries:
+        if not entry["raw"]:
+            continue
+        children = children_keys and entry.get(children_keys[0]) or []
+        result.append('<div class="depth%s" title="%s" '
+            'style="flex: %s 1 0; flex-direction: %s">%s</div>' % (
+            depth, cgi.escape(_describe(entry), True), entry["raw"],
+            direction,
+            children and _treemap(children, depth + 1, children_keys[1:])
+            or "<span>%s</span>" % cgi.escape(entry["name"])))
+    return "".join(result)
+
+_child_class = dict(file="package", package="module")
+
+def _table_rows(entries, css_class, children_keys):
+    rows = []
+    for entry in entries:
+        compressed = entry["compressed"]
+        rows.append('<tr class="%s"><td class="name">%s</td><td>%s</td>'
+            '<td>%s</td><td>%s</td></tr>' % (css_class,
+            cgi.escape(entry["name"]), entry["raw"], entry["gzip"],
+            compressed is not None and compressed or ""))
+        if children_keys:
+            rows.extend(_table_rows(entry[children_keys[0]],
+                _child_class[css_class], children_keys[1:]))
+    return rows
+
+def render_html(report):
+    """Returns the report as an HTML page with a treemap and a table."""
+    files = report["files"]
+    treemap = '<div class="map" style="flex-direction: column">%s</div>' % (
+        _treemap(files, 0, ["packages", "modules"]))
+    rows = _table_rows(files, "file", ["packages", "modules"])
+    return _html_template % (treemap, "\n".join(rows))
+
+def write_report(report, filename):
+    """Writes the report as JSON to filename, and as HTML to a file next to
+    it with an .html extension."""
+    filename = path(filename)
+    filename.write_bytes(dumps(report, sort_keys=True, indent=1))
+    html_file = path(filename.splitext()[0] + ".html")
+    html_file.write_bytes(render_html(report).encode("utf8"))
+    return html_file
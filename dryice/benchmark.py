@@ -0,0 +1,290 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+"""Benchmarks for the dryice build pipeline.
+
+This generates a tree of synthetic plugins of a configurable size and
+times each stage of a build against it. Results are appended to a JSON
+file, along with the git commit being measured, so that runs from
+different commits can be compared. Run it with:
+
+    python -m dryice.benchmark --plugins 100 --files 10
+
+Use --help for all of the options."""
+
+import os
+import sys
+import time
+import optparse
+import subprocess
+from StringIO import StringIO
+
+try:
+    from json import loads, dumps
+except ImportError:
+    from simplejson import loads, dumps
+
+from dryice.path import path
+from dryice import plugins, combiner, tool
+
+# marks a directory that generate_tree made, and so may replace
+_marker = ".dryice-benchmark"
+
+class BenchmarkError(Exception):
+    pass
+
+_filler = "    exports.value%d = function(a, b) { return a + b + %d; };\n"
+
+def _module_text(index, size, dependencies):
+    lines = ["// synthetic module %d\n" % index]
+    for dep in dependencies:
+        lines.append("var %s = require('%s');\n" % (dep, dep))
+    i = 0
+    total = sum(len(line) for line in lines)
+    while total < size:
+        line = _filler % (i, index)
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return "".join(lines)
+
+def generate_tree(directory, plugin_count=20, files_per_plugin=5,
+                  file_size=2000, dependency_depth=3):
+    """Creates a synthetic plugin tree in directory and returns a dict
+    with the search path and the names of the generated plugins.
+
+    Plugin number i depends on up to dependency_depth of the plugins
+    right before it, so the dependency graph has long chains like real
+    builds do. Every plugin gets files_per_plugin modules of about
+    file_size bytes each, a stylesheet, a template and a resource.
+
+    A tree generated before is replaced, but a BenchmarkError is raised
+    rather than deleting any other directory that isn't empty."""
+    directory = path(directory)
+    if directory.exists():
+        if not (directory / _marker).exists() and directory.listdir():
+            raise BenchmarkError("%s exists and wasn't generated by the "
+                                 "benchmark, so it won't be replaced"
+                                 % directory)
+        directory.rmtree()
+    plugin_dir = directory / "plugins"
+    plugin_dir.makedirs()
+    (directory / _marker).write_text("")
+
+    # the bits of a build that normally come from the Bespin tree
+    (directory / "loader.js").write_text("var tiki = {};\n")
+    (directory / "worker.js").write_text("// worker\n")
+    bespin = plugin_dir / "bespin"
+    bespin.makedirs()
+    (bespin / "package.json").write_text(dumps(dict(
+        environments=dict(main=True, worker=True))))
+    (bespin / "index.js").write_text(_module_text(0, file_size, []))
+
+    names = []
+    for i in range(plugin_count):
+        name = "plugin%d" % i
+        deps = names[max(0, i - dependency_depth):i]
+        names.append(name)
+        location = plugin_dir / name
+        (location / "resources" / "images").makedirs()
+        (location / "templates").makedirs()
+        (location / "package.json").write_text(dumps(dict(
+            dependencies=dict((dep, "0.0") for dep in deps))))
+        for j in range(files_per_plugin):
+            modname = "index" if j == 0 else "module%d" % j
+            (location / (modname + ".js")).write_text(
+                _module_text(j, file_size, deps))
+        (location / "resources" / "style.css").write_text(
+            ".%s { background-image: url(images/icon.png); }\n" % name)
+        (location / "resources" / "images" / "icon.png").write_bytes(
+            "\x89PNG\r\n\x1a\n" + "\0" * 64)
+        (location / "templates" / "main.htmlt").write_text(
+            "<div class='%s'><%%= name %%></div>\n" % name)
+
+    return dict(directory=directory, plugins=names,
+                search_path=[dict(name="synthetic", path=plugin_dir)])
+
+def _time(func, repeat):
+    """Returns the best wall clock time of repeat calls to func."""
+    best = None
+    for i in range(repeat):
+        started = time.time()
+        func()
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def run(tree, repeat=3, jobs=1):
+    """Times the stages of a build of the generated tree. Returns a
+    dictionary mapping stage names to seconds."""
+    directory = tree["directory"]
+    search_path = tree["search_path"]
+    names = tree["plugins"]
+    output_dir = directory / "build"
+    cache_dir = directory / "cache"
+
+    def make_manifest(**kw):
+        return tool.Manifest(plugins=list(names),
+            search_path=[dict(entry) for entry in search_path],
+            output_dir=output_dir, loader=directory / "loader.js",
+            worker=directory / "worker.js", jobs=jobs, **kw)
+
+    def find():
+        plugins.find_plugins(search_path)
+
+    def combine():
+        manifest = make_manifest()
+        for name in ["bespin"] + names:
+            plugin = manifest.get_plugin(name)
+            combiner.combine_files(StringIO(), StringIO(), plugin,
+                                   plugin.location)
+
+    def build():
+        make_manifest().build()
+
+    def cached_build():
+        make_manifest(cache_dir=cache_dir).build()
+
+    # Manifest looks for a "plugins" directory in the current directory,
+    # so run from the generated tree to keep the real plugins out of it
+    cwd = os.getcwd()
+    os.chdir(directory)
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        results = dict(
+            find_plugins=_time(find, repeat),
+            manifest=_time(make_manifest, repeat),
+            combine_files=_time(combine, repeat),
+            build=_time(build, repeat),
+        )
+        # warm the cache, then time builds that can use it
+        cached_build()
+        results["build_cached"] = _time(cached_build, repeat)
+    finally:
+        sys.stdout = stdout
+        os.chdir(cwd)
+    return results
+
+def _git_commit():
+    try:
+        p = subprocess.Popen(["git", "rev-parse", "--short", "HEAD"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            cwd=path(__file__).dirname())
+        out = p.communicate()[0].strip()
+        if p.returncode == 0:
+            return out
+    except OSError:
+        pass
+    return None
+
+def load_results(filename):
+    filename = path(filename)
+    if not filename.exists():
+        return []
+    return loads(filename.text())
+
+def save_result(filename, result):
+    results = load_results(filename)
+    results.append(result)
+    path(filename).write_text(dumps(results, indent=2))
+
+def compare(previous, current):
+    """Returns lines comparing the timings of two results."""
+    lines = []
+    for stage in sorted(current["timings"]):
+        now = current["timings"][stage]
+        before = previous["timings"].get(stage)
+        if before:
+            lines.append("  %-14s %8.3fs  (was %8.3fs, %+.0f%%)" % (stage,
+                now, before, (now - before) / before * 100))
+        else:
+            lines.append("  %-14s %8.3fs" % (stage, now))
+    return lines
+
+def main(args=None):
+    if args is None:
+        args = sys.argv
+    parser = optparse.OptionParser(
+        description="Benchmarks dryice against a synthetic plugin tree.")
+    parser.add_option("--plugins", type="int", default=20,
+        help="number of plugins to generate")
+    parser.add_option("--files", type="int", default=5,
+        help="number of modules in each plugin")
+    parser.add_option("--size", type="int", default=2000,
+        help="approximate size of each module, in bytes")
+    parser.add_option("--depth", type="int", default=3,
+        help="how many of the previous plugins each plugin depends on")
+    parser.add_option("--repeat", type="int", default=3,
+        help="number of runs of each stage (the best one is reported)")
+    parser.add_option("--jobs", type="int", default=1,
+        help="number of processes for combining")
+    parser.add_option("--tree", default="tmp/benchmark",
+        help="directory in which to generate the plugins (it is replaced, "
+             "so it must not exist or be one that the benchmark made)")
+    parser.add_option("--results", default="benchmark-results.json",
+        help="JSON file to append the results to")
+    options, args = parser.parse_args(args)
+
+    params = dict(plugins=options.plugins, files=options.files,
+                  size=options.size, depth=options.depth,
+                  jobs=options.jobs)
+    try:
+        tree = generate_tree(path(options.tree).abspath(), options.plugins,
+                             options.files, options.size, options.depth)
+    except BenchmarkError, e:
+        parser.error(str(e))
+    timings = run(tree, options.repeat, options.jobs)
+    result = dict(commit=_git_commit(), date=time.time(), params=params,
+                  timings=timings)
+
+    previous = [r for r in load_results(options.results)
+                if r["params"] == params]
+    print "dryice benchmark: %(plugins)s plugins, %(files)s files " \
+          "of %(size)s bytes, depth %(depth)s, %(jobs)s job(s)" % params
+    if previous:
+        print "compared to commit %s:" % (previous[-1]["commit"])
+        for line in compare(previous[-1], result):
+            print line
+    else:
+        for line in compare(dict(timings={}), result):
+            print line
+    save_result(options.results, result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+"""A persistent, content-addressed cache for build products. Entries are
+stored as JSON files in a directory and are looked up by a key computed
+from everything that went into producing them."""
+
+import os
+import hashlib
+import tempfile
+
+try:
+    from json import loads, dumps
+except ImportError:
+    from simplejson import loads, dumps
+
+from dryice.path import path
+
+# bump this whenever the format of the combined output changes, so that
+# stale entries from an older dryice are not reused.
+CACHE_VERSION = "4"
+
+def file_signature(location):
+    """Returns a list describing the files at location (a file or a
+    directory tree), including their sizes and modification times. Two
+    equal signatures mean that the files have not changed."""
+    if not location.isdir():
+        st = location.stat()
+        return [["", st.st_size, st.st_mtime]]
+
+    # the files are all joined onto location, so slicing gives their
+    # relative paths much more cheaply than relpathto
+    prefix = len(os.path.join(location, ""))
+    result = []
+    for f in path(location).scanfiles():
+        st = os.stat(f)
+        result.append([f[prefix:].replace(os.sep, "/"), st.st_size,
+                       st.st_mtime])
+    result.sort()
+    return result
+
+def file_hash(location):
+    """Returns the SHA-1 hex digest of the contents of a file."""
+    h = hashlib.sha1()
+    f = location.open("rb")
+    try:
+        while True:
+            d = f.read(65536)
+            if not d:
+                break
+            h.update(d)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+class BuildCache(object):
+    """Stores build products in a directory. Each kind of product goes into
+    its own subdirectory, so that unrelated entries can be cleared
+    independently."""
+
+    def __init__(self, directory):
+        self.directory = path(directory)
+
+    def key(self, *parts):
+        """Computes a cache key from the given JSON-serializable parts."""
+        h = hashlib.sha1(CACHE_VERSION)
+        for part in parts:
+            h.update(dumps(part, sort_keys=True))
+            h.update("\0")
+        return h.hexdigest()
+
+    def plugin_key(self, plugin, include_tests, image_path_prepend,
+                   minify_css=False, inline_images=0):
+        """Computes the key for the combined output of a plugin."""
+        return self.key(plugin.name, plugin.location.abspath(),
+                        file_signature(plugin.location),
+                        include_tests, image_path_prepend, minify_css,
+                        inline_images)
+
+    def plugin_slot(self, plugin, include_tests, image_path_prepend,
+                    minify_css=False, inline_images=0):
+        """Computes the slot for the combined output of a plugin (see
+        put). This is the key without the plugin's files, so each edit
+        to the plugin replaces the entry for the previous version."""
+        return self.key("slot", plugin.name, plugin.location.abspath(),
+                        include_tests, image_path_prepend, minify_css,
+                        inline_images)
+
+    def _entry(self, kind, key, ext=".json"):
+        return self.directory / kind / (key + ext)
+
+    def _store(self, entry, write):
+        entry_dir = entry.dirname()
+        if not entry_dir.isdir():
+            try:
+                entry_dir.makedirs()
+            except OSError:
+                # another thread or process may have just created it
+                if not entry_dir.isdir():
+                    raise
+        # write to a temporary file first so that an interrupted build
+        # never leaves a truncated entry behind
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=entry_dir)
+        os.close(fd)
+        tmp = path(tmp)
+        write(tmp)
+        if os.name == "nt" and entry.exists():
+            entry.remove()
+        tmp.rename(entry)
+
+    def get(self, kind, key):
+        """Returns the value stored under key, or None if there is no
+        such entry."""
+        entry = self._entry(kind, key)
+        if not entry.exists():
+            return None
+        try:
+            return loads(entry.text("utf8"))
+        except ValueError:
+            # a partially written or corrupt entry is just a miss
+            return None
+
+    def put(self, kind, key, value, slot=None):
+        """Stores value under key. If slot is given, the entry that was
+        stored before with the same slot is removed, as it has been
+        superseded. Without that, the cache would gain an entry with
+        every change."""
+        self._store(self._entry(kind, key),
+                    lambda tmp: tmp.write_bytes(dumps(value)))
+        if slot is None:
+            return
+        record = self._entry(kind, slot, ".slot")
+        if record.exists():
+            previous = record.text().strip()
+            if previous != key:
+                stale = self._entry(kind, previous)
+                if stale.exists():
+                    stale.remove()
+        self._store(record, lambda tmp: tmp.write_bytes(key))
+
+    def get_file(self, kind, key):
+        """Returns the path of the file stored under key, or None if there
+        is no such entry."""
+        entry = self._entry(kind, key, ".data")
+        if not entry.exists():
+            return None
+        return entry
+
+    def put_file(self, kind, key, source):
+        """Stores a copy of the file at source under key."""
+        self._store(self._entry(kind, key, ".data"),
+                    lambda tmp: source.copyfile(tmp))
@@ -37,9 +37,12 @@
 
 """Combines the JavaScript files appropriately."""
 
-import re
+import codecs
 
-from dryice.plugins import wrap_script
+from dryice.path import path
+from dryice.plugins import wrap_script, module_prologue, module_epilogue
+from dryice.sourcemap import TrackingWriter
+from dryice import stylesheets
 
 try:
     from json import dumps
@@ -69,31 +72,149 @@ class NullOutput(object):
 class CombinerError(Exception):
     pass
 
-_css_images_url = re.compile(r'url\(\s*([\'"]*)images/')
+class DependencyGraph(object):
+    """The dependencies between packages. lookup is called with a package
+    name and returns an object with name and dependencies attributes (or
+    raises KeyError). Packages are looked up once and each sort is only
+    done once, so the same graph can be asked about several sets of
+    roots cheaply."""
 
-def write_metadata(jsfile, plugin, plugin_location=None):
+    def __init__(self, lookup):
+        self._lookup = lookup
+        self._packages = {}
+        self._sorted = {}
+
+    def package(self, name, required_by=None):
+        """Returns the package called name."""
+        try:
+            return self._packages[name]
+        except KeyError:
+            pass
+        try:
+            pkg = self._lookup(name)
+        except KeyError:
+            if required_by is None:
+                raise CombinerError("Plugin %s not found" % name)
+            raise CombinerError("Plugin %s (required by %s) not found"
+                                % (name, required_by))
+        self._packages[name] = pkg
+        return pkg
+
+    def sort(self, root_names):
+        """Returns the list of root packages and all their dependencies,
+        topologically sorted. Raises a CombinerError if the packages
+        depend on each other in a cycle."""
+        key = tuple(root_names)
+        try:
+            return list(self._sorted[key])
+        except KeyError:
+            pass
+
+        done = set()
+        result = []
+        for root in root_names:
+            if root in done:
+                continue
+            # an explicit stack rather than recursion, so that long chains
+            # of dependencies don't hit the recursion limit
+            stack = [(root, iter(self.package(root).dependencies))]
+            active = set([root])
+            while stack:
+                name, deps = stack[-1]
+                for dep in deps:
+                    if dep in done:
+                        continue
+                    if dep in active:
+                        names = [entry[0] for entry in stack]
+                        cycle = names[names.index(dep):] + [dep]
+                        raise CombinerError("Plugins depend on each other "
+                                            "in a cycle: %s"
+                                            % " -> ".join(cycle))
+                    active.add(dep)
+                    stack.append((dep,
+                        iter(self.package(dep, name).dependencies)))
+                    break
+                else:
+                    stack.pop()
+                    active.remove(name)
+                    done.add(name)
+                    result.append(self.package(name))
+
+        self._sorted[key] = result
+        return list(result)
+
+# how much of a source file copy_text reads at a time
+_chunk_size = 65536
+
+def _normalize_newlines(text):
+    # the same translation that path.text() does
+    return (text.replace(u'\r\n', u'\n')
+                .replace(u'\r\x85', u'\n')
+                .replace(u'\r', u'\n')
+                .replace(u'\x85', u'\n')
+                .replace(u'\u2028', u'\n'))
+
+def copy_text(f, output, chunk_size=_chunk_size):
+    """Copies the UTF-8 text file f to output a chunk at a time, with all
+    newlines translated to \\n like path.text() does. This avoids
+    holding (several copies of) the whole file in memory."""
+    infile = codecs.open(f, "r", "utf8")
+    try:
+        pending = u""
+        while True:
+            chunk = infile.read(chunk_size)
+            if not chunk:
+                break
+            chunk = pending + chunk
+            # a \r at the end may be the first half of a \r\n, so it
+            # waits for the next chunk
+            if chunk.endswith(u"\r"):
+                pending = u"\r"
+                chunk = chunk[:-1]
+            else:
+                pending = u""
+            output.write(_normalize_newlines(chunk))
+        if pending:
+            output.write(u"\n")
+    finally:
+        infile.close()
+
+_resource_template = """
+        {
+            url: bespin.base + %s,
+            type: '%s',
+            id: %s,
+            name: %s
+        }"""
+
+def write_metadata(jsfile, plugin, plugin_location=None,
+                   stylesheet_location=None, resource_id=None):
     """Writes the "tiki.register" line for a plugin to a file. If
     "plugin_location" is specified, this describes a dynamic plugin that will
     be fetched from that URL. Otherwise, this "tiki.register" line describes
-    a plugin defined within "jsfile"."""
+    a plugin defined within "jsfile". A dynamic plugin's CSS can be given
+    as "stylesheet_location", to be loaded along with the plugin.
+    "resource_id" is the id of the script resource, which defaults to the
+    plugin name followed by ".js". Plugins that share a file (a bundle)
+    share its id too."""
     name, deps = plugin.name, plugin.dependencies
 
-    jsfilename = name + ".js"
-    deps_js = ", ".join([ '%s: "0.0.0"' % dumps(dep) for dep in deps ])
+    jsfilename = resource_id or (name + ".js")
+    deps_js = ", ".join([ '%s: "0.0.0"' % dumps(dep) for dep in sorted(deps) ])
 
     if plugin_location is None:
         resources_js = ""
     else:
+        resources = [ _resource_template % (dumps(plugin_location), 'script',
+            dumps(jsfilename), dumps(jsfilename)) ]
+        if stylesheet_location is not None:
+            cssfilename = jsfilename[:-len(".js")] + ".css"
+            resources.append(_resource_template % (
+                dumps(stylesheet_location), 'stylesheet',
+                dumps(cssfilename), dumps(cssfilename)))
         resources_js = """,
-    'tiki:resources': [
-        {
-            url: bespin.base + %s,
-            type: 'script',
-            id: %s,
-            name: %s
-        }
-    ]""" \
-            % (dumps(plugin_location), dumps(jsfilename), dumps(jsfilename))
+    'tiki:resources': [%s
+    ]""" % (",".join(resources))
 
 
     jsfile.write(""";bespin.tiki.register(%s, {
@@ -108,7 +229,9 @@ def write_metadata(jsfile, plugin, plugin_location=None):
         jsfile.write("""bespin.bootLoaded = true;""");
 
 def combine_files(jsfile, cssfile, plugin, p,
-        exclude_tests=True, image_path_prepend=None):
+        exclude_tests=True, image_path_prepend=None, segments=None,
+        exclude_modules=None, minify_css=False, css_cache=None,
+        inline_images=0, template_problems=None):
     """Combines the files in an plugin into a single .js and .css file, wrapped
     appropriately for Tiki.
     
@@ -120,23 +243,47 @@ def combine_files(jsfile, cssfile, plugin, p,
     p: path object pointing to the app's directory
     exclude_tests: should contents of tests directories be included in the
         combined output?
+    segments: if given, a list to which (source name, filename, line, line
+        count) is appended for each module, where line is the line of the
+        JavaScript output that the module's source starts on. This is what
+        the source maps are built from.
+    exclude_modules: names of modules to leave out
+    minify_css: should the CSS be minified?
+    css_cache: a BuildCache to keep the processed CSS of each file in
+    inline_images: images referenced from the CSS that are no bigger than
+        this many bytes are put into the CSS as data: URIs
+    template_problems: if given, a list to which the problems found in the
+        plugin's templates are added. Otherwise they are printed.
     """
     name = plugin.name
 
+    if segments is not None:
+        # to tell which lines of the output each module's source is on
+        jsfile = TrackingWriter(jsfile)
+
     if cssfile is None:
         cssfile = NullOutput()
 
     has_index = False
 
     if p.isdir():
-        for f in p.walkfiles("*.css"):
-            if image_path_prepend:
-                content = _css_images_url.sub("url(\\1%simages/" % (image_path_prepend), f.text())
-                cssfile.write(content)
-            else:
-                cssfile.write(f.text('utf8'))
+        if p == plugin.location:
+            files = plugin.files
+        else:
+            files = path(p).partitionfiles(dict(js="*.js", css="*.css"))
+
+        resources = plugin.location / "resources"
+        for f in files["css"]:
+            # urls are relative to the stylesheet. A stylesheet outside of
+            # the resources directory is treated as if it were in it.
+            directory = resources.relpathto(f.dirname()).replace("\\", "/")
+            if directory.startswith(".."):
+                directory = ""
+            cssfile.write(stylesheets.process(f.text('utf8'), directory,
+                image_path_prepend, minify_css, css_cache, resources,
+                inline_images))
             
-        filelist = p.walkfiles("*.js")
+        filelist = files["js"]
         single_file = False
     else:
         filelist = [p]
@@ -148,21 +295,38 @@ def combine_files(jsfile, cssfile, plugin, p,
         
         if single_file:
             modname = "index"
+            source = f.basename()
         else:
             modname = p.relpathto(f.splitext()[0])
             # for the sake of Windows users, ensure that we are
             # only using slashes
             modname = modname.replace("\\", "/")
+            source = "%s/%s%s" % (name, modname, f.ext)
+
+        if exclude_modules and modname in exclude_modules:
+            continue
             
         if modname == "index":
             has_index = True
         
-        jsfile.write(wrap_script(plugin, modname, f.text('utf8')))
+        jsfile.write(module_prologue(plugin, modname))
+        if segments is None:
+            copy_text(f, jsfile)
+        else:
+            start = jsfile.line
+            copy_text(f, jsfile)
+            segments.append((source, f, start, jsfile.lines_since(start)))
+        jsfile.write(module_epilogue())
     
     if not has_index:
         jsfile.write(wrap_script(plugin, "index", ""))
     
-    template_module = plugin.template_module
+    template_module, problems = plugin.compile_templates()
+    if template_problems is not None:
+        template_problems.extend(problems)
+    else:
+        for problem in problems:
+            print "Warning: template problem in %s: %s" % (name, problem)
     if template_module:
         jsfile.write(wrap_script(plugin, "templates", template_module))
 
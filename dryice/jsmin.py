@@ -0,0 +1,223 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+
+"""A JavaScript minifier that needs nothing but Python. It works on tokens,
+so strings and regular expression literals come through untouched, and
+removes comments and whitespace. Line breaks are only removed where that
+can't change the meaning of the code (through semicolon insertion).
+The Closure Compiler makes smaller files, but this is much faster and
+doesn't need Java."""
+
+import re
+
+class MinifyError(Exception):
+    pass
+
+_space = u"[ \t\f\v\u00a0\ufeff\u1680\u2000-\u200a\u202f\u205f\u3000]+"
+_newline = u"\r\n|[\n\r\u2028\u2029]"
+_newlines = re.compile(_newline)
+_comment = u"//[^\n\r\u2028\u2029]*|/\\*.*?\\*/"
+_string = (r"""'(?:\\(?:\r\n|[\s\S])|[^'\\\n\r])*'"""
+           r'''|"(?:\\(?:\r\n|[\s\S])|[^"\\\n\r])*"'''
+           r"""|`(?:\\[\s\S]|[^`\\])*`""")
+_number = r"0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?"
+_word = r"(?:[\w$]|\\u[0-9a-fA-F]{4}|[^\x00-\x7f])+"
+_punctuator = (r">>>=|>>>|===|!==|<<=|>>=|\*\*=|\.\.\.|=>"
+               r"|[<>=!+\-*/%&|^]=|&&|\|\||\+\+|--|<<|>>|\*\*"
+               r"|[{}()\[\];,<>+\-*/%&|^!~?:=.@#]")
+
+# one pattern for everything but regular expression literals, which can
+# only be told apart from division by what came before them. The groups
+# are told apart by number, in this order.
+_SPACE, _NEWLINE, _COMMENT, _STRING, _NUMBER, _WORD, _PUNCTUATOR = \
+    range(1, 8)
+_token = re.compile(u"(%s)|(%s)|(%s)|(%s)|(%s)|(%s)|(%s)"
+                    % (_space, _newline, _comment, _string, _number, _word,
+                       _punctuator), re.S | re.U)
+_regex = re.compile(r"/(?:\\.|\[(?:\\.|[^\]\\\n\r])*\]|[^/\\\[\n\r])+/\w*",
+                    re.U)
+
+# after these keywords, a / starts a regular expression rather than
+# being a division
+_regex_keywords = frozenset(u"""return typeof instanceof in of new delete
+    void throw case do else yield await""".split())
+
+WORD, NUMBER, STRING, REGEX, PUNCTUATOR = range(5)
+
+# a line break after one of these, or before one of the second set, can
+# be dropped: the statement can't end there, so no semicolon would have
+# been inserted. (The tokens are unicode, like the text, as comparing
+# them to byte strings is slow.)
+_continues_after = frozenset(u"""{ ( [ ; , < > <= >= == != === !== + - * /
+    % ** << >> >>> & | ^ ! ~ && || ? : = += -= *= /= %= **= <<= >>= >>>= &=
+    |= ^= => . ...""".split())
+_continues_before = frozenset(u""". , ; : ? ) ] } = == === != !== < > <= >=
+    && || & | ^ * / % ** += -= *= /= %= **= << >> >>> <<= >>= >>>= &= |= ^=
+    =>""".split())
+_ends_operand = frozenset(u") ] } ++ --".split())
+
+def tokenize(text):
+    """Yields (kind, token, newline_before, line, column) for each token
+    in text, where newline_before says whether there was a line break
+    between it and the token before. Comments that start with /*! (usually
+    licenses) are passed on as STRING tokens so that they are kept."""
+    pos = 0
+    end = len(text)
+    line = 0
+    line_start = 0
+    newline = False
+    # whether a / here would start a regular expression
+    regex_allowed = True
+    while pos < end:
+        column = pos - line_start
+        if regex_allowed and text[pos] == u"/" \
+                and text[pos + 1:pos + 2] not in (u"/", u"*"):
+            match = _regex.match(text, pos)
+            if not match:
+                raise MinifyError("Unterminated regular expression on "
+                                  "line %s" % (line + 1))
+            pos = match.end()
+            yield REGEX, match.group(0), newline, line, column
+            newline = False
+            regex_allowed = False
+            continue
+
+        match = _token.match(text, pos)
+        if match is None:
+            c = text[pos]
+            if c in u"'\"`":
+                raise MinifyError("Unterminated string on line %s"
+                                  % (line + 1))
+            raise MinifyError("Unexpected character %r on line %s"
+                              % (c, line + 1))
+        group = match.lastindex
+        token = match.group(0)
+        pos = match.end()
+
+        if group == _SPACE:
+            continue
+        if group == _NEWLINE:
+            line += 1
+            line_start = pos
+            newline = True
+            continue
+        if group == _PUNCTUATOR and token == u"/" \
+                and text.startswith(u"/*", pos - 1):
+            raise MinifyError("Unterminated comment on line %s"
+                              % (line + 1))
+
+        token_line = line
+        if group == _COMMENT or group == _STRING:
+            breaks = _newlines.findall(token)
+            if breaks:
+                line += len(breaks)
+                line_start = pos - len(_newlines.split(token)[-1])
+
+        if group == _COMMENT:
+            if token.startswith(u"/*!"):
+                yield STRING, token, newline, token_line, column
+                newline = False
+            elif breaks:
+                newline = True
+            continue
+        if group == _STRING:
+            kind = STRING
+            regex_allowed = False
+        elif group == _NUMBER:
+            kind = NUMBER
+            regex_allowed = False
+        elif group == _WORD:
+            kind = WORD
+            regex_allowed = token in _regex_keywords
+        else:
+            kind = PUNCTUATOR
+            regex_allowed = token not in _ends_operand
+        yield kind, token, newline, token_line, column
+        newline = False
+
+def _needs_space(prev_kind, prev, kind, token):
+    if prev_kind in (WORD, NUMBER) and kind in (WORD, NUMBER):
+        return True
+    if prev_kind == NUMBER and token.startswith(u"."):
+        return True
+    if prev_kind == REGEX and kind == WORD:
+        return True
+    last = prev[-1]
+    first = token[0]
+    if last in u"+-" and first == last:
+        return True
+    if last == u"/" and first in u"/*":
+        return True
+    return False
+
+def minify(text, sourcemap=None, source=None):
+    """Returns text, a JavaScript program, minified. If sourcemap (a
+    sourcemap.SourceMap) is given, the first token from each line of
+    text is mapped to where it came from in source."""
+    output = []
+    out_line = 0
+    out_column = 0
+    prev_kind = prev = None
+    mapped_line = -1
+    for kind, token, newline, line, column in tokenize(text):
+        if prev is not None:
+            if newline and prev not in _continues_after \
+                    and token not in _continues_before:
+                separator = u"\n"
+            elif _needs_space(prev_kind, prev, kind, token):
+                separator = u" "
+            else:
+                separator = u""
+            if separator:
+                output.append(separator)
+                if separator == u"\n":
+                    out_line += 1
+                    out_column = 0
+                else:
+                    out_column += 1
+        if sourcemap is not None and line != mapped_line:
+            sourcemap.add(out_line, out_column, source, line, column)
+            mapped_line = line
+        output.append(token)
+        if kind == STRING and _newlines.search(token):
+            out_line += len(_newlines.findall(token))
+            out_column = len(_newlines.split(token)[-1])
+        else:
+            out_column += len(token)
+        prev_kind, prev = kind, token
+    return u"".join(output)
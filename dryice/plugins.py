@@ -34,7 +34,9 @@
 #
 # ***** END LICENSE BLOCK *****
 # 
+import os
 import re
+import stat
 from urllib import quote as urlquote
 
 try:
@@ -42,6 +44,9 @@ try:
 except ImportError:
     from simplejson import loads, dumps
 
+from dryice.path import path
+from dryice import templates as _templates
+
 _metadata_declaration = re.compile("^[^=]*=\s*")
 _trailing_semi = re.compile(";*\s*$")
 _leading_paren = re.compile(r"^\s*\(\s*")
@@ -49,12 +54,28 @@ _trailing_paren = re.compile(r"\s*\)\s*$")
 _start_tag = re.compile(r'^\s*[\'"]define\s+metadata[\'"]\s*;*\s*$')
 _end_tag = re.compile(r'^\s*[\'"]end[\'"]\s*;*\s*$')
 
-def wrap_script(plugin, mod_name, script_text):
-    return """
+# the groups that a plugin's files are sorted into by Plugin.files
+_file_groups = dict(js="*.js", css="*.css", templates="*.htmlt",
+                    tests="test*")
+
+_module_prologue = """
 bespin.tiki.module("%s:%s",function(require,exports,module) {
-%s
+"""
+
+_module_epilogue = """
 });
-""" % (plugin.name, mod_name, script_text)
+"""
+
+def module_prologue(plugin, mod_name):
+    """Returns the text that starts the module wrapper. The module's
+    source goes between this and module_epilogue()."""
+    return _module_prologue % (plugin.name, mod_name)
+
+def module_epilogue():
+    return _module_epilogue
+
+def wrap_script(plugin, mod_name, script_text):
+    return module_prologue(plugin, mod_name) + script_text + _module_epilogue
 
 def _parse_md_text(lines):
     """Parses the plugin metadata out of the lines of the JS file.
@@ -143,15 +164,38 @@ class Plugin(object):
     def testmodules(self):
         """Returns a list of test modules in this plugin. Test modules
         are in directories called 'tests' and start with the word test."""
+        try:
+            return self._testmodules
+        except AttributeError:
+            pass
+
         if not self.location.isdir():
             return []
             
         tests = []
-        for d in self.location.walkdirs("tests"):
-            for f in d.walkfiles("test*"):
-                tests.append(self.location.relpathto(f).splitext()[0])
+        loc = self.location
+        for f in self.files["tests"]:
+            rel = loc.relpathto(f)
+            if "tests" in rel.splitall()[:-1]:
+                tests.append(rel.splitext()[0])
         return tests
     
+    @property
+    def files(self):
+        """The files of a directory plugin, found with a single walk of
+        the plugin's tree and sorted into the groups in _file_groups
+        (js, css, templates and tests). Single file plugins have no
+        files here."""
+        try:
+            return self._files
+        except AttributeError:
+            if self.location.isdir():
+                files = path(self.location).partitionfiles(_file_groups)
+            else:
+                files = dict((name, []) for name in _file_groups)
+            self._files = files
+            return files
+
     @property
     def single_file(self):
         """Returns true if this is a single file plugin
@@ -164,7 +208,11 @@ class Plugin(object):
         
         A Plugin subclass can override this to add additional information
         to the metadata."""
-        md, errors = get_metadata(self.location)
+        try:
+            md, errors = self._raw_metadata
+            md = dict(md)
+        except AttributeError:
+            md, errors = get_metadata(self.location)
         
         self._errors = errors
         
@@ -178,16 +226,17 @@ class Plugin(object):
         return md
         
 
-    def _putFilesInAttribute(self, attribute, glob, allowEmpty=True):
-        """Finds all of the plugin files matching the given glob
-        and puts them in the attribute given. If the
-        attribute is already set, it is returned directly."""
+    def _putFilesInAttribute(self, attribute, group, allowEmpty=True):
+        """Finds all of the plugin files in the given group of
+        self.files and puts their relative paths in the attribute
+        given. If the attribute is already set, it is returned
+        directly."""
         try:
             return getattr(self, attribute)
         except AttributeError:
             loc = self.location
             if loc.isdir():
-                l = [loc.relpathto(f) for f in loc.walkfiles(glob)]
+                l = [loc.relpathto(f) for f in self.files[group]]
             else:
                 l = [] if allowEmpty else [""]
             setattr(self, attribute, l)
@@ -196,11 +245,11 @@ class Plugin(object):
     
     @property
     def stylesheets(self):
-        return self._putFilesInAttribute("_stylesheets", "*.css")
+        return self._putFilesInAttribute("_stylesheets", "css")
     
     @property
     def scripts(self):
-        return self._putFilesInAttribute("_scripts", "*.js", 
+        return self._putFilesInAttribute("_scripts", "js", 
             allowEmpty=False)
         
     @property
@@ -211,22 +260,24 @@ class Plugin(object):
             if not loc.exists():
                 return {}
 
-            return dict((loc.relpathto(f), f.text("utf8")) 
-                for f in loc.walkfiles("*.htmlt"))
+            return dict((loc.relpathto(f), f.text("utf8"))
+                for f in self.files["templates"]
+                if self.location.relpathto(f).splitall()[1] == "templates")
         else:
             return {}
     
     @property
     def template_module(self):
+        return self.compile_templates()[0]
+
+    def compile_templates(self):
+        """Returns the source of this plugin's "templates" module (or
+        None, if it has no templates) and a list of problems found in the
+        templates."""
         templates = self.templates
         if not templates:
-            return None
-
-        return """
-var templater = require('templater');
-
-templater.compileAll(%s, exports);
-""" % (dumps(templates))
+            return None, []
+        return _templates.compile_templates(templates)
         
         
     def get_script_text(self, scriptname):
@@ -245,6 +296,166 @@ templater.compileAll(%s, exports);
         
                 
 
+def _dir_signature(location):
+    """Returns a dictionary mapping each directory in the tree at location
+    to its modification time. Adding or removing anything changes the
+    mtime of its parent directory, so the signature can later be checked
+    with one stat per directory and no directory listings."""
+    result = {}
+    for dirpath, dirnames, filenames in os.walk(location):
+        result[dirpath] = os.stat(dirpath).st_mtime
+    return result
+
+def _file_signature(location):
+    st = os.stat(location)
+    return [st.st_size, st.st_mtime]
+
+def _signature_matches(signature):
+    for name, mtime in signature.items():
+        try:
+            if os.stat(name).st_mtime != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+class PluginIndex(object):
+    """A persistent index of the plugins on a search path, stored as JSON
+    in filename. It remembers which plugins are in each search path
+    directory (until the mtime of the directory or of one of its
+    subdirectories changes) and each plugin's
+    parsed metadata and test modules (until one of its files or
+    directories changes), so that finding plugins does not need to scan
+    and parse everything again."""
+
+    # bump this when the format of the index changes
+    version = 2
+
+    def __init__(self, filename):
+        self.filename = path(filename)
+        self._dirty = False
+        self._paths = {}
+        self._plugins = {}
+        if self.filename.exists():
+            try:
+                data = loads(self.filename.text("utf8"))
+            except ValueError:
+                data = None
+            if data and data.get("version") == self.version:
+                self._paths = data["paths"]
+                self._plugins = data["plugins"]
+
+    def find_plugins(self, search_path, cls=Plugin):
+        """Works like find_plugins, but uses and updates the index."""
+        result = []
+        for path_entry in search_path:
+            if "plugin" in path_entry:
+                name = path_entry["plugin"].basename()
+                if name.endswith(".js"):
+                    name = name[:-3]
+                plugin = _get_plugin(name, path_entry, cls)
+                if plugin is not None:
+                    result.append(self._prepare(plugin))
+                continue
+
+            for name, item in self._list_plugins(path_entry["path"]):
+                result.append(self._prepare(cls(name, item, path_entry)))
+        return result
+
+    def _list_plugins(self, directory):
+        key = directory.abspath()
+        try:
+            signature = _listing_signature(directory)
+        except OSError:
+            return []
+        entry = self._paths.get(key)
+        if entry is not None and entry["signature"] == signature:
+            return [(name, directory / basename)
+                    for name, basename in entry["plugins"]]
+
+        found = _scan_directory(directory)
+        self._paths[key] = dict(signature=signature,
+            plugins=[(name, item.basename()) for name, item in found])
+        self._dirty = True
+        return found
+
+    def _prepare(self, plugin):
+        """Gives the plugin its metadata and test modules from the index,
+        computing them and adding them to the index if need be."""
+        location = plugin.location
+        key = location.abspath()
+        entry = self._plugins.get(key)
+        if location.isdir():
+            md_file = location / "package.json"
+            md_signature = (_file_signature(md_file)
+                            if md_file.exists() else None)
+        else:
+            md_signature = _file_signature(location)
+
+        if entry is None or entry["md_signature"] != md_signature \
+            or not _signature_matches(entry["dirs"]):
+            md, errors = get_metadata(location)
+            if location.isdir():
+                dirs = _dir_signature(location)
+            else:
+                dirs = {}
+            entry = dict(md_signature=md_signature, dirs=dirs,
+                         md=md, errors=errors,
+                         testmodules=plugin.testmodules)
+            self._plugins[key] = entry
+            self._dirty = True
+
+        plugin._raw_metadata = (entry["md"], entry["errors"])
+        plugin._testmodules = entry["testmodules"]
+        return plugin
+
+    def save(self):
+        """Writes the index out, if anything has changed."""
+        if not self._dirty:
+            return
+        directory = self.filename.dirname()
+        if directory and not directory.isdir():
+            directory.makedirs()
+        tmp = path(self.filename + ".%s.tmp" % os.getpid())
+        tmp.write_bytes(dumps(dict(version=self.version,
+                                   paths=self._paths,
+                                   plugins=self._plugins)))
+        if os.name == "nt" and self.filename.exists():
+            self.filename.remove()
+        tmp.rename(self.filename)
+        self._dirty = False
+
+def _listing_signature(directory):
+    """Returns the mtimes of a search path directory and of the
+    directories in it. Adding a package.json to one of those directories
+    only changes the mtime of that directory, so that is needed to tell
+    when it becomes a plugin."""
+    result = [os.stat(directory).st_mtime]
+    for name in sorted(os.listdir(directory)):
+        st = os.stat(os.path.join(directory, name))
+        if stat.S_ISDIR(st.st_mode):
+            result.append([name, st.st_mtime])
+    return result
+
+def _scan_directory(directory):
+    """Returns (name, location) pairs for the plugins in a search path
+    directory."""
+    result = []
+    for item in directory.glob("*"):
+        # plugins are directories with a package.json file or 
+        # individual .js files.
+        if item.isdir():
+            mdfile = item / "package.json"
+            if not mdfile.exists():
+                continue
+            name = item.basename()
+        elif item.ext == ".js":
+            name = item.splitext()[0].basename()
+        else:
+            continue
+        result.append((name, item))
+    return result
+
 def find_plugins(search_path, cls=Plugin):
     """Return plugin descriptors for the plugins on the search_path.
     If the search_path is not given, the configured plugin_path will
@@ -262,20 +473,7 @@ def find_plugins(search_path, cls=Plugin):
             result.append(plugin)
             continue
                 
-        path = path_entry['path']
-        for item in path.glob("*"):
-            # plugins are directories with a package.json file or 
-            # individual .js files.
-            if item.isdir():
-                mdfile = item / "package.json"
-                if not mdfile.exists():
-                    continue
-                name = item.basename()
-            elif item.ext == ".js":
-                name = item.splitext()[0].basename()
-            else:
-                continue
-                
+        for name, item in _scan_directory(path_entry['path']):
             plugin = cls(name, item, path_entry)
             result.append(plugin)
     return result
@@ -0,0 +1,265 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+"""Version 3 source maps for the combined output files, so that positions
+in BespinEmbedded.js and friends can be traced back to the plugin files
+they came from."""
+
+from dryice.path import path
+
+_base64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+_base64_values = dict((c, i) for i, c in enumerate(_base64))
+
+def encode_vlq(value):
+    """Returns the base64 VLQ encoding of an integer."""
+    if value < 0:
+        value = ((-value) << 1) | 1
+    else:
+        value = value << 1
+    result = []
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value:
+            digit |= 32
+        result.append(_base64[digit])
+        if not value:
+            return "".join(result)
+
+def decode_vlq(text, pos):
+    """Decodes the VLQ value starting at text[pos]. Returns the value and
+    the position after it."""
+    value = 0
+    shift = 0
+    while True:
+        digit = _base64_values[text[pos]]
+        pos += 1
+        value += (digit & 31) << shift
+        shift += 5
+        if not digit & 32:
+            break
+    if value & 1:
+        return -(value >> 1), pos
+    return value >> 1, pos
+
+class SourceMap(object):
+    """Maps positions in a generated file to positions in source files.
+    Lines and columns are zero-based, as in the source map format."""
+
+    def __init__(self, file=None):
+        self.file = file
+        self.sources = []
+        self._source_index = {}
+        # the file each source can be read from, for sourcesContent
+        self.source_files = {}
+        self.source_contents = {}
+        # for each generated line, a list of
+        # (column, source index, source line, source column)
+        self.lines = []
+
+    def _index(self, source):
+        try:
+            return self._source_index[source]
+        except KeyError:
+            index = len(self.sources)
+            self.sources.append(source)
+            self._source_index[source] = index
+            return index
+
+    def add(self, line, column, source, source_line, source_column):
+        """Maps line:column of the generated file to a source position."""
+        while len(self.lines) <= line:
+            self.lines.append([])
+        self.lines[line].append((column, self._index(source),
+                                 source_line, source_column))
+
+    def add_lines(self, line, source, source_line, count, filename=None,
+                  column=0):
+        """Maps count lines starting at line of the generated file to the
+        lines starting at source_line of source, which can be read from
+        filename. The first of the lines starts at column of the generated
+        file, the rest at the beginning of their lines."""
+        if filename is not None:
+            self.source_files[source] = filename
+        for i in xrange(count):
+            self.add(line + i, column if i == 0 else 0, source,
+                     source_line + i, 0)
+
+    def lookup(self, line, column):
+        """Returns the (source, line, column) that line:column of the
+        generated file came from, or None if it is not mapped."""
+        if line >= len(self.lines):
+            return None
+        found = None
+        for segment in self.lines[line]:
+            if segment[0] > column:
+                break
+            found = segment
+        if found is None:
+            return None
+        seg_column, source, source_line, source_column = found
+        return (self.sources[source], source_line,
+                source_column + column - seg_column)
+
+    def mappings(self):
+        """Returns the encoded "mappings" string."""
+        result = []
+        prev_source = prev_line = prev_column = 0
+        for segments in self.lines:
+            encoded = []
+            prev_gen_column = 0
+            for column, source, source_line, source_column in \
+                sorted(segments):
+                encoded.append(encode_vlq(column - prev_gen_column)
+                    + encode_vlq(source - prev_source)
+                    + encode_vlq(source_line - prev_line)
+                    + encode_vlq(source_column - prev_column))
+                prev_gen_column = column
+                prev_source = source
+                prev_line = source_line
+                prev_column = source_column
+            result.append(",".join(encoded))
+        return ";".join(result)
+
+    def to_json(self, include_content=True):
+        """Returns the source map as a dictionary ready to be dumped as
+        JSON. With include_content, the text of the sources is included
+        so that the map works without access to the original files."""
+        data = dict(version=3, sources=self.sources, names=[],
+                    mappings=self.mappings())
+        if self.file:
+            data["file"] = self.file
+        if include_content:
+            contents = []
+            for source in self.sources:
+                if source in self.source_contents:
+                    contents.append(self.source_contents[source])
+                elif source in self.source_files:
+                    contents.append(
+                        path(self.source_files[source]).text("utf8"))
+                else:
+                    contents.append(None)
+            data["sourcesContent"] = contents
+        return data
+
+    @classmethod
+    def from_json(cls, data):
+        """Creates a SourceMap from a dictionary loaded from JSON."""
+        smap = cls(data.get("file"))
+        sources = data.get("sources", [])
+        for source in sources:
+            smap._index(source)
+        contents = data.get("sourcesContent") or []
+        for source, content in zip(sources, contents):
+            if content is not None:
+                smap.source_contents[source] = content
+
+        mappings = data.get("mappings", "")
+        source = source_line = source_column = 0
+        for line_number, line in enumerate(mappings.split(";")):
+            column = 0
+            for segment in line.split(","):
+                if not segment:
+                    continue
+                values = []
+                pos = 0
+                while pos < len(segment):
+                    value, pos = decode_vlq(segment, pos)
+                    values.append(value)
+                column += values[0]
+                if len(values) < 4:
+                    continue
+                source += values[1]
+                source_line += values[2]
+                source_column += values[3]
+                smap.add(line_number, column, sources[source], source_line,
+                         source_column)
+        return smap
+
+def compose(outer, inner):
+    """Given outer, which maps a file to the generated file that inner
+    describes, returns a map from outer's generated file straight to
+    inner's sources. This is how a compressor's map of the combined
+    output is turned into a map to the original plugin files."""
+    result = SourceMap(outer.file)
+    for line, segments in enumerate(outer.lines):
+        for column, source, source_line, source_column in segments:
+            found = inner.lookup(source_line, source_column)
+            if found is None:
+                continue
+            result.add(line, column, *found)
+    result.source_files = inner.source_files
+    result.source_contents = inner.source_contents
+    return result
+
+class TrackingWriter(object):
+    """Wraps a file, keeping track of the line and column that the next
+    write will start at so that content can be added to sourcemap at the
+    right position."""
+
+    def __init__(self, f, sourcemap=None):
+        self.f = f
+        self.line = 0
+        self.column = 0
+        if sourcemap is None:
+            sourcemap = SourceMap()
+        self.sourcemap = sourcemap
+
+    def write(self, text):
+        self.f.write(text)
+        newlines = text.count("\n")
+        if newlines:
+            self.line += newlines
+            self.column = len(text) - text.rindex("\n") - 1
+        else:
+            self.column += len(text)
+
+    def lines_since(self, line):
+        """Returns how many lines with content have been written since
+        the writer was at the beginning of line."""
+        return self.line - line + (self.column and 1)
+
+    def write_file(self, text, source, filename):
+        """Writes text, which is the full content of filename, mapping
+        its lines to source."""
+        line, column = self.line, self.column
+        self.write(text)
+        self.sourcemap.add_lines(line, source, 0, self.lines_since(line),
+                                 filename, column)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
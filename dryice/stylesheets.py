@@ -0,0 +1,199 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+
+"""Processes the plugins' CSS as it is combined: references to images and
+other files are pointed at where the build puts them and, optionally,
+small images are inlined, the CSS is minified and rules that appear more
+than once are dropped.
+
+The .less files that plugins list as theme styles are not touched, as
+they are compiled in the browser with the variables of the current
+theme."""
+
+import re
+import base64
+import hashlib
+import mimetypes
+import posixpath
+
+_url = re.compile(r"""url\(\s*(['"]?)([^'")]*?)\1\s*\)""")
+
+# urls with a scheme (http:, data: and so on), absolute paths and
+# fragments are left as they are
+_absolute = re.compile(r"^(?:[a-zA-Z][a-zA-Z0-9+.-]*:|/|#)")
+
+_comment_or_string = re.compile(
+    r"""(/\*.*?\*/)|("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')""", re.S)
+
+_placeholder = re.compile(r"\x00(\d+)\x00")
+
+_statement_end = re.compile(
+    r"""/\*.*?\*/|"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|[{};]""", re.S)
+
+def _resolve(directory, url):
+    """Returns the path, relative to the plugin's resources directory, of
+    the file that url refers to from a stylesheet in directory, or None
+    if url isn't relative or leads out of the resources directory."""
+    if not url or _absolute.match(url):
+        return None
+    target = posixpath.normpath(posixpath.join(directory, url))
+    if target == ".." or target.startswith("../"):
+        return None
+    return target
+
+def rewrite_urls(text, directory, prefix):
+    """Rewrites the relative url()s in text, a stylesheet in directory
+    (relative to the plugin's resources directory), to start with prefix,
+    which is where the build puts the plugin's resources. References that
+    lead out of the resources directory are left alone."""
+    def replace(match):
+        quote, url = match.groups()
+        target = _resolve(directory, url)
+        if target is None:
+            return match.group(0)
+        return "url(%s%s%s%s)" % (quote, prefix, target, quote)
+    return _url.sub(replace, text)
+
+def inline_images(text, directory, resources, limit):
+    """Replaces the relative url()s in text, a stylesheet in directory,
+    that point at images in resources (the plugin's resources directory)
+    of no more than limit bytes with data: URIs, which saves a request
+    for each of them."""
+    def replace(match):
+        quote, url = match.groups()
+        if "?" in url or "#" in url:
+            return match.group(0)
+        target = _resolve(directory, url)
+        if target is None:
+            return match.group(0)
+        mimetype = mimetypes.guess_type(target)[0]
+        if mimetype is None or not mimetype.startswith("image/"):
+            return match.group(0)
+        f = resources / target
+        if not f.isfile() or f.size > limit:
+            return match.group(0)
+        return 'url("data:%s;base64,%s")' % (mimetype,
+                                            base64.b64encode(f.bytes()))
+    return _url.sub(replace, text)
+
+def minify(text):
+    """Removes the comments and the whitespace that doesn't matter from a
+    stylesheet. Comments that start with /*! (usually licenses) are
+    kept."""
+    kept = []
+    def protect(match):
+        comment, string = match.groups()
+        if comment is not None and not comment.startswith("/*!"):
+            return " "
+        kept.append(match.group(0))
+        return "\x00%d\x00" % (len(kept) - 1)
+    text = _comment_or_string.sub(protect, text)
+
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r" ?([{};,>]) ?", r"\1", text)
+    # only after the colon, as "a :hover" and "a:hover" are different
+    # selectors
+    text = re.sub(r": ", ":", text)
+    text = re.sub(r";+}", "}", text)
+    text = text.strip()
+
+    return _placeholder.sub(lambda match: kept[int(match.group(1))], text)
+
+def split_rules(text):
+    """Splits a stylesheet into its top level statements: rules (and
+    @-rules with blocks, such as @media) along with the @-rules that end
+    with a semicolon. Any comments go with the statement after them."""
+    result = []
+    start = 0
+    depth = 0
+    for match in _statement_end.finditer(text):
+        token = match.group(0)
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+            if depth == 0:
+                result.append(text[start:match.end()])
+                start = match.end()
+        elif token == ";" and depth == 0:
+            result.append(text[start:match.end()])
+            start = match.end()
+    if text[start:].strip():
+        result.append(text[start:])
+    return result
+
+def dedupe(text):
+    """Drops the rules that appear again later in a minified stylesheet.
+    The later copy is the one that is kept, so the cascade works out the
+    same. Statements like @import, which have to stay where they are,
+    are never dropped."""
+    rules = split_rules(text)
+    last = {}
+    for i, rule in enumerate(rules):
+        last[rule] = i
+    return u"".join([rule for i, rule in enumerate(rules)
+                     if last[rule] == i or not rule.endswith("}")])
+
+def process(text, directory, prefix=None, minified=False, cache=None,
+            resources=None, inline_limit=0):
+    """Returns a plugin's stylesheet ready to be combined: with the
+    images in resources of up to inline_limit bytes inlined (see
+    inline_images), its other urls rewritten if prefix is given (see
+    rewrite_urls) and minified if minified is true. If cache (a
+    BuildCache) is given, the result is kept there under the hash of the
+    stylesheet's content."""
+    if inline_limit and resources is not None:
+        # this comes before the cache, so that the images' content is
+        # part of what the result is cached under
+        text = inline_images(text, directory, resources, inline_limit)
+
+    if cache is not None:
+        key = cache.key("css", hashlib.sha1(text.encode("utf8")).hexdigest(),
+                        directory, prefix, minified)
+        cached = cache.get("css", key)
+        if cached is not None:
+            return cached["css"]
+
+    if prefix:
+        text = rewrite_urls(text, directory, prefix)
+    if minified:
+        text = minify(text)
+
+    if cache is not None:
+        cache.put("css", key, dict(css=text))
+    return text
@@ -0,0 +1,136 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+
+"""Keeps copies of directory trees up to date. Rather than deleting the
+previous copy and copying everything again, only the files that have
+changed are copied, and files that are no longer in the source are
+removed."""
+
+import os
+import stat
+import shutil
+
+class Syncer(object):
+    """Syncs files and directory trees. If link is true, files are hard
+    linked rather than copied where possible. Counts of what was done are
+    kept in copied, linked, skipped and removed."""
+
+    def __init__(self, link=False):
+        self.link = link
+        self.copied = 0
+        self.linked = 0
+        self.skipped = 0
+        self.removed = 0
+
+    def _delete(self, target):
+        if os.path.isdir(target) and not os.path.islink(target):
+            shutil.rmtree(target)
+        else:
+            os.remove(target)
+
+    def _remove(self, target):
+        self._delete(target)
+        self.removed += 1
+
+    def sync_file(self, source, target):
+        """Makes target a copy of the file source, unless it already has the
+        same size and modification time."""
+        st = os.stat(source)
+        try:
+            tst = os.lstat(target)
+        except OSError:
+            tst = None
+        if tst is not None:
+            if stat.S_ISREG(tst.st_mode) and tst.st_size == st.st_size \
+                    and int(tst.st_mtime) == int(st.st_mtime):
+                self.skipped += 1
+                return
+            # the old file is removed rather than written over, as it
+            # may be a link to the source of a previous build
+            self._delete(target)
+
+        if self.link:
+            try:
+                os.link(source, target)
+                self.linked += 1
+                return
+            except (AttributeError, OSError):
+                # no hard links on this platform, or source and target
+                # are on different filesystems
+                self.link = False
+        shutil.copy2(source, target)
+        self.copied += 1
+
+    def sync_tree(self, source, target, ignore=None):
+        """Makes target a copy of the directory tree source. ignore is
+        called like the one for shutil.copytree, with a directory and the
+        names in it, and returns the names that are not to be copied.
+        Those are removed from target too."""
+        stack = [(source, target)]
+        while stack:
+            source_dir, target_dir = stack.pop()
+            if os.path.lexists(target_dir) and not os.path.isdir(target_dir):
+                self._remove(target_dir)
+            if not os.path.isdir(target_dir):
+                os.makedirs(target_dir)
+
+            names = os.listdir(source_dir)
+            if ignore is not None:
+                ignored = set(ignore(source_dir, names))
+                names = [name for name in names if name not in ignored]
+            for name in sorted(names):
+                s = os.path.join(source_dir, name)
+                t = os.path.join(target_dir, name)
+                if os.path.isdir(s):
+                    stack.append((s, t))
+                else:
+                    if os.path.isdir(t) and not os.path.islink(t):
+                        self._remove(t)
+                    self.sync_file(s, t)
+            self.remove_others(target_dir, names)
+
+    def remove_others(self, directory, names):
+        """Removes everything in directory except for names."""
+        names = set(names)
+        for name in os.listdir(directory):
+            if name not in names:
+                self._remove(os.path.join(directory, name))
+
+    def summary(self):
+        return "%s copied, %s linked, %s unchanged, %s removed" % (
+            self.copied, self.linked, self.skipped, self.removed)
@@ -0,0 +1,115 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+"""Builds the "templates" module for a plugin's .htmlt templates, and checks
+the templates for the mistakes that the templater plugin would otherwise
+only complain about at runtime. The module hands the templates to
+templater.compileAll when it loads, as before; the checks don't change
+the output."""
+
+import re
+from HTMLParser import HTMLParser, HTMLParseError
+
+try:
+    from json import dumps
+except ImportError:
+    from simplejson import dumps
+
+_module_template = """
+var templater = require('templater');
+
+templater.compileAll(%s, exports);
+"""
+
+# attributes whose value must have a ${...} reference in it. templater's
+# stripBraces looks for one anywhere in the value.
+_reference_attributes = ["save", "if", "foreach"]
+_reference = re.compile(r"\$\{.*\}")
+
+def _unterminated(text):
+    """Returns True if text has a ${ without a closing }."""
+    start = text.find("${")
+    while start != -1:
+        end = text.find("}", start)
+        if end == -1:
+            return True
+        start = text.find("${", end)
+    return False
+
+class _TemplateChecker(HTMLParser):
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.problems = []
+
+    def _problem(self, message):
+        self.problems.append("line %s: %s" % (self.getpos()[0], message))
+
+    def handle_starttag(self, tag, attrs):
+        for name, value in attrs:
+            if value is None:
+                value = ""
+            if name in _reference_attributes or name.startswith("on"):
+                if not _reference.search(value):
+                    self._problem("the value of %s on <%s> should look "
+                                  "like ${...}" % (name, tag))
+            elif _unterminated(value):
+                self._problem("unterminated ${ in %s on <%s>" % (name, tag))
+
+    def handle_data(self, data):
+        if _unterminated(data):
+            self._problem("unterminated ${ in text")
+
+def check_template(text):
+    """Returns a list of the problems found in a template."""
+    checker = _TemplateChecker()
+    try:
+        checker.feed(text)
+        checker.close()
+    except HTMLParseError, e:
+        checker.problems.append("line %s: %s" % (e.lineno, e.msg))
+    return checker.problems
+
+def compile_templates(templates):
+    """Takes a dictionary of template filename to template text, as
+    Plugin.templates returns, and returns the source of the plugin's
+    "templates" module along with a list of the problems found in the
+    templates."""
+    problems = []
+    for filename in sorted(templates):
+        for problem in check_template(templates[filename]):
+            problems.append("%s, %s" % (filename, problem))
+    return _module_template % (dumps(templates),), problems
@@ -0,0 +1,133 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+import sys
+from StringIO import StringIO
+
+
+
+from dryice import tool, analyze
+from dryice.path import path
+from dryice.sourcemap import SourceMap
+
+try:
+    from json import loads
+except ImportError:
+    from simplejson import loads
+
+plugindir = path(__file__).dirname() / "plugindir"
+pluginpath = [dict(name="pl", path=plugindir)]
+
+def test_source_sizes():
+    smap = SourceMap()
+    smap.add(0, 0, "a.js", 0, 0)
+    smap.add(0, 10, "b.js", 3, 0)
+    smap.add(0, 15, "a.js", 1, 0)
+    smap.add(1, 2, "b.js", 4, 0)
+    text = "0123456789abcdefghij\n0123\n"
+    sizes = analyze.source_sizes(smap, text)
+    assert sizes == {"a.js": 15, "b.js": 7}
+
+def test_gzip_size():
+    data = "var x = 1;\n" * 1000
+    assert 0 < analyze.gzip_size(data) < len(data) / 10
+    assert analyze.gzip_size(u"\u2603") > 0
+
+def test_analyze_build():
+    tmppath = path.getcwd() / "tmp" / "analyze"
+    manifest = tool.Manifest(plugins=["plugin1"],
+        dynamic_plugins=["SingleFilePlugin1"], search_path=pluginpath,
+        include_tests=True, output_dir=tmppath,
+        loader=plugindir / "SingleFilePlugin2.js")
+    manifest.build()
+    report = analyze.analyze(manifest)
+    files = dict((entry["name"], entry) for entry in report["files"])
+    assert files["BespinMain.js"]["raw"] == \
+        (tmppath / "BespinMain.js").size
+    assert files["BespinMain.js"]["compressed"] is None
+
+    packages = dict((entry["name"], entry)
+                    for entry in files["BespinMain.js"]["packages"])
+    plugin1 = packages["plugin1"]
+    modules = [entry["name"] for entry in plugin1["modules"]]
+    assert "plugin1/thecode.js" in modules
+    sizes = [entry["raw"] for entry in plugin1["modules"]]
+    assert sizes == sorted(sizes, reverse=True)
+    assert plugin1["raw"] > sum(sizes)
+    assert plugin1["gzip"] < plugin1["raw"]
+
+    dynamic = files["plugins/SingleFilePlugin1.js"]["packages"]
+    assert [entry["name"] for entry in dynamic] == ["SingleFilePlugin1"]
+
+    html_file = analyze.write_report(report, tmppath / "report.json")
+    assert loads((tmppath / "report.json").text()) == report
+    html = html_file.text()
+    assert "plugin1/thecode.js" in html
+    assert "<table>" in html
+
+def test_analyze_turns_on_source_maps():
+    class Options(object):
+        jscompressor = None
+        csscompressor = None
+        minify = True
+        timings = None
+
+    tmppath = path.getcwd() / "tmp" / "analyzemaps"
+    if tmppath.exists():
+        tmppath.rmtree()
+    tmppath.makedirs()
+    options = Options()
+    options.analyze = tmppath / "sizes.json"
+    for source_maps in (False, True):
+        manifest_file = tmppath / "manifest.json"
+        manifest_file.write_text(tool.dumps(dict(plugins=["plugin1"],
+            search_path=[plugindir], include_tests=True,
+            output_dir=tmppath / "build", source_maps=source_maps,
+            loader=plugindir / "SingleFilePlugin2.js")))
+        output = StringIO()
+        stdout = sys.stdout
+        sys.stdout = output
+        try:
+            assert tool.do_build(manifest_file, options, {})
+        finally:
+            sys.stdout = stdout
+        # only mentioned when the manifest didn't ask for the maps itself
+        assert ("Turning on source_maps" in output.getvalue()) \
+            == (not source_maps)
+        assert (tmppath / "build" / "BespinMain.js.map").exists()
+        report = loads(options.analyze.text())
+        files = dict((entry["name"], entry) for entry in report["files"])
+        assert files["BespinMain.js"]["compressed"] is not None
@@ -0,0 +1,81 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+
+from dryice import benchmark, plugins
+from dryice.path import path
+
+treepath = path.getcwd() / "tmp" / "benchmarktree"
+
+def test_generated_tree():
+    tree = benchmark.generate_tree(treepath, plugin_count=4,
+        files_per_plugin=2, file_size=100, dependency_depth=2)
+    found = dict((p.name, p)
+                 for p in plugins.find_plugins(tree["search_path"]))
+    assert sorted(found.keys()) == ["bespin", "plugin0", "plugin1",
+                                    "plugin2", "plugin3"]
+    assert sorted(found["plugin3"].dependencies.keys()) == \
+        ["plugin1", "plugin2"]
+    assert len(found["plugin3"].scripts) == 2
+
+def test_only_generated_trees_are_replaced():
+    benchmark.generate_tree(treepath, plugin_count=1, files_per_plugin=1,
+                            file_size=10)
+    # a tree that the benchmark made is replaced
+    benchmark.generate_tree(treepath, plugin_count=1, files_per_plugin=1,
+                            file_size=10)
+
+    other = path.getcwd() / "tmp" / "notatree"
+    if other.exists():
+        other.rmtree()
+    other.makedirs()
+    (other / "precious.txt").write_text("keep me")
+    try:
+        benchmark.generate_tree(other, plugin_count=1)
+    except benchmark.BenchmarkError:
+        pass
+    else:
+        assert False, "Expected a BenchmarkError"
+    assert (other / "precious.txt").text() == "keep me"
+
+def test_run_times_every_stage():
+    tree = benchmark.generate_tree(treepath, plugin_count=3,
+        files_per_plugin=2, file_size=100)
+    timings = benchmark.run(tree, repeat=1)
+    assert sorted(timings.keys()) == ["build", "build_cached",
+        "combine_files", "find_plugins", "manifest"]
+    assert (treepath / "build" / "BespinEmbedded.js").exists()
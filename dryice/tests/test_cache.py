@@ -0,0 +1,166 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+
+import os
+import sys
+from StringIO import StringIO
+
+from dryice import tool, combiner
+from dryice.cache import BuildCache, file_signature, file_hash
+from dryice.path import path
+
+plugindir = path(__file__).dirname() / "plugindir"
+pluginpath = [dict(name="pl", path=plugindir)]
+cachedir = path.getcwd() / "tmp" / "testcache"
+
+def setup():
+    if cachedir.exists():
+        cachedir.rmtree()
+
+def test_cache_roundtrip():
+    cache = BuildCache(cachedir)
+    key = cache.key("foo", [1, 2])
+    assert key == cache.key("foo", [1, 2])
+    assert key != cache.key("foo", [1, 3])
+    assert cache.get("things", key) is None
+    cache.put("things", key, dict(js=u"some code"))
+    assert cache.get("things", key) == dict(js=u"some code")
+
+def test_file_signature():
+    sig = file_signature(plugindir / "plugin1")
+    names = [entry[0] for entry in sig]
+    assert "thecode.js" in names
+    assert "templates/one.htmlt" in names
+    sig = file_signature(plugindir / "SingleFilePlugin1.js")
+    assert len(sig) == 1
+
+def test_combined_plugin_is_cached():
+    manifest = tool.Manifest(plugins=["plugin1"], search_path=pluginpath,
+        include_tests=True, cache_dir=cachedir)
+    plugin = manifest.get_plugin("plugin1")
+    js, css = manifest._combine_plugin(plugin)
+    assert 'tiki.module("plugin1:thecode"' in js
+    assert "color: white" in css
+
+    def fail(*args, **kw):
+        raise AssertionError("combine_files should not be called")
+
+    real_combine_files = combiner.combine_files
+    combiner.combine_files = fail
+    try:
+        cached_js, cached_css = manifest._combine_plugin(plugin)
+    finally:
+        combiner.combine_files = real_combine_files
+    assert cached_js == js
+    assert cached_css == css
+
+def test_superseded_plugin_entries_are_removed():
+    tmppath = path.getcwd() / "tmp" / "cacheeviction"
+    if tmppath.exists():
+        tmppath.rmtree()
+    source = tmppath / "plugins" / "evicted.js"
+    source.dirname().makedirs()
+    searchpath = [dict(name="pl", path=source.dirname())]
+    entries = tmppath / "cache" / "plugins"
+    for i in range(3):
+        source.write_text('"define metadata";\n({});\n"end";\n'
+                          'exports.version = %s;\n' % i)
+        os.utime(source, (1000 + i, 1000 + i))
+        manifest = tool.Manifest(plugins=["evicted"], search_path=searchpath,
+            cache_dir=tmppath / "cache")
+        js, css = manifest._combine_plugin(manifest.get_plugin("evicted"))
+        assert "exports.version = %s;" % i in js
+        assert len(entries.files("*.json")) == 1
+
+    # other settings for the same plugin get an entry of their own
+    manifest = tool.Manifest(dynamic_plugins=["evicted"],
+        search_path=searchpath, cache_dir=tmppath / "cache")
+    manifest._combine_plugin(manifest.get_plugin("evicted"))
+    assert len(entries.files("*.json")) == 2
+
+def test_template_problems_are_reported_from_cache():
+    tmppath = path.getcwd() / "tmp" / "templatecache"
+    if tmppath.exists():
+        tmppath.rmtree()
+    (tmppath / "badtemplates" / "templates").makedirs()
+    (tmppath / "badtemplates" / "package.json").write_text("{}")
+    (tmppath / "badtemplates" / "templates" / "bad.htmlt").write_text(
+        "<p onclick='go'/>")
+    searchpath = [dict(name="tmp", path=tmppath)]
+
+    for i in range(2):
+        manifest = tool.Manifest(plugins=["badtemplates"],
+            search_path=searchpath, cache_dir=tmppath / "cache")
+        output = StringIO()
+        stdout = sys.stdout
+        sys.stdout = output
+        real_combine_files = combiner.combine_files
+        if i:
+            # the second time round, the plugin comes from the cache
+            combiner.combine_files = None
+        try:
+            manifest._combine_plugins(["badtemplates"])
+        finally:
+            sys.stdout = stdout
+            combiner.combine_files = real_combine_files
+        assert "Warning: template problem in badtemplates: bad.htmlt" \
+            in output.getvalue()
+
+def test_compressed_output_is_restored_from_cache():
+    tmppath = path.getcwd() / "tmp" / "compresscache"
+    if tmppath.exists():
+        tmppath.rmtree()
+    tmppath.makedirs()
+    compressor = tmppath / "compiler.jar"
+    compressor.write_text("not really a jar")
+    jsfile = tmppath / "BespinMain.js"
+    jsfile.write_text("var someVariable = 1;\n")
+
+    manifest = tool.Manifest(plugins=["plugin1"], search_path=pluginpath,
+        output_dir=tmppath, cache_dir=cachedir)
+    cache = manifest.build_cache
+    key = cache.key("closure", file_hash(jsfile), file_hash(compressor),
+                    "--warning_level=QUIET")
+    compressed = tmppath / "compressed.js"
+    compressed.write_text("var a=1;")
+    cache.put_file("compressed", key, compressed)
+
+    manifest._created_javascript.add(jsfile)
+    manifest.compress_js(compressor)
+    assert jsfile.text() == "var a=1;"
+    assert (tmppath / "BespinMain.uncompressed.js").exists()
@@ -35,10 +35,12 @@
 # ***** END LICENSE BLOCK *****
 
 from cStringIO import StringIO
+import StringIO as pyStringIO
 
 from path import path
 
-from dryice.combiner import Package, combine_files
+from dryice.combiner import Package, combine_files, copy_text, \
+    DependencyGraph, CombinerError
 from dryice.plugins import Plugin
 
 def test_package_index_generation():
@@ -51,3 +53,55 @@ def test_package_index_generation():
     assert 'tiki.module("noindexapp:index"' in combined
     assert 'tiki.main' not in combined
 
+
+def test_copy_text_normalizes_newlines():
+    tmppath = path.getcwd() / "tmp"
+    if not tmppath.exists():
+        tmppath.makedirs()
+    f = tmppath / "newlines.js"
+    text = u"one\r\ntwo\rthree\nfour\r\r\nfive \u2603\u2028six\r"
+    f.write_bytes(text.encode("utf8"))
+    expected = f.text("utf8")
+    for chunk_size in [1, 2, 3, 5, 64]:
+        output = pyStringIO.StringIO()
+        copy_text(f, output, chunk_size)
+        assert output.getvalue() == expected, chunk_size
+
+def _graph(deps):
+    calls = []
+    def lookup(name):
+        calls.append(name)
+        return Package(name, deps[name])
+    return DependencyGraph(lookup), calls
+
+def test_dependency_graph_sort():
+    graph, calls = _graph(dict(a=[], b=[], c=["a", "b"], d=["b"], e=["d"]))
+    names = [p.name for p in graph.sort(list("ceabd"))]
+    assert names == list("abcde")
+    assert [p.name for p in graph.sort(["e"])] == list("bde")
+    # each package is only looked up once
+    assert sorted(calls) == list("abcde")
+
+def test_dependency_graph_long_chain():
+    count = 5000
+    deps = dict(("p%d" % i, ["p%d" % (i + 1)]) for i in range(count))
+    deps["p%d" % count] = []
+    graph, calls = _graph(deps)
+    result = graph.sort(["p0"])
+    assert len(result) == count + 1
+    assert result[0].name == "p%d" % count
+
+def test_dependency_graph_errors():
+    graph, calls = _graph(dict(a=["b"], b=["c"], c=["a"], d=["missing"]))
+    try:
+        graph.sort(["a"])
+    except CombinerError, e:
+        assert "a -> b -> c -> a" in str(e)
+    else:
+        assert False, "expected a cycle to be reported"
+    try:
+        graph.sort(["d"])
+    except CombinerError, e:
+        assert "missing (required by d)" in str(e)
+    else:
+        assert False, "expected a missing plugin to be reported"
@@ -0,0 +1,76 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+
+from dryice.jsmin import minify, MinifyError
+from dryice.sourcemap import SourceMap
+
+def test_minify():
+    assert minify(u"""/*! license */
+// a comment
+var a = b
+    / 2 / c;   /* division */
+var r = /[/]\\/+/g.test(s) ,  t = "a  // b" + 'c /* d */';
+if (a) { f(a - -b, a + +c, 1 .toString(), x in y) }
+else return
+x
+""") == u"""/*! license */
+var a=b/2/c;var r=/[/]\\/+/g.test(s),t="a  // b"+'c /* d */';if(a){f(a- -b,a+ +c,1 .toString(),x in y)}
+else return
+x"""
+
+def test_minify_keeps_line_breaks_that_matter():
+    # a semicolon is inserted at each of these line breaks
+    assert minify(u"a = b\n++c\nx = {}\ny()") == u"a=b\n++c\nx={}\ny()"
+    # but not at these
+    assert minify(u"a = b\n.c(\n1,\n2\n)") == u"a=b.c(1,2)"
+
+def test_minify_errors():
+    for text in [u"var s = 'abc", u"/* abc", u"x = /abc"]:
+        try:
+            minify(text)
+        except MinifyError:
+            pass
+        else:
+            assert False, "Expected a MinifyError for %r" % text
+
+def test_minify_source_map():
+    smap = SourceMap()
+    assert minify(u"var a = 1;\n\n  var b = 2;\nf(a,\n  b);", smap,
+                  "x.js") == u"var a=1;var b=2;f(a,b);"
+    assert smap.lookup(0, 8) == ("x.js", 2, 2)
+    assert smap.lookup(0, 18) == ("x.js", 3, 2)
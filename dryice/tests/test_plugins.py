@@ -35,6 +35,8 @@
 # ***** END LICENSE BLOCK *****
 
 
+import os
+
 try:
     from json import loads
 except ImportError:
@@ -202,4 +204,69 @@ def test_templates_in_plugin():
     
     tm = plugin.template_module
     assert "js micro template" in tm
-    
\ No newline at end of file
+    
+def test_plugin_index():
+    tmppath = path.getcwd() / "tmp" / "pluginindex"
+    if tmppath.exists():
+        tmppath.rmtree()
+    tmppath.makedirs()
+    indexfile = tmppath / "index.json"
+    copied = tmppath / "plugins"
+    plugindir.copytree(copied)
+    searchpath = [dict(name="testplugins", path=copied, chop=len(copied))]
+
+    expected = dict((p.name, p) for p in plugins.find_plugins(searchpath))
+    index = plugins.PluginIndex(indexfile)
+    found = dict((p.name, p) for p in index.find_plugins(searchpath))
+    index.save()
+    assert sorted(found.keys()) == sorted(expected.keys())
+    for name in expected:
+        assert found[name].metadata == expected[name].metadata
+        assert found[name].location == expected[name].location
+
+    def fail(location):
+        raise AssertionError("get_metadata called for %s" % location)
+
+    real_get_metadata = plugins.get_metadata
+    plugins.get_metadata = fail
+    try:
+        index = plugins.PluginIndex(indexfile)
+        found = dict((p.name, p) for p in index.find_plugins(searchpath))
+        p = found["plugin1"]
+        assert p.dependencies["plugin2"] == "0.0"
+        assert "tests/testFoo" in p.testmodules
+    finally:
+        plugins.get_metadata = real_get_metadata
+
+    # a new test module is picked up
+    (copied / "plugin2" / "tests").makedirs()
+    (copied / "plugin2" / "tests" / "testNew.js").write_text("")
+    index = plugins.PluginIndex(indexfile)
+    found = dict((p.name, p) for p in index.find_plugins(searchpath))
+    assert found["plugin2"].testmodules == ["tests/testNew"]
+
+def test_plugin_index_finds_new_package_json():
+    tmppath = path.getcwd() / "tmp" / "pluginindexnew"
+    if tmppath.exists():
+        tmppath.rmtree()
+    copied = tmppath / "plugins"
+    plugindir.copytree(copied)
+    searchpath = [dict(name="testplugins", path=copied, chop=len(copied))]
+    indexfile = tmppath / "index.json"
+
+    newplugin = copied / "newplugin"
+    newplugin.makedirs()
+    index = plugins.PluginIndex(indexfile)
+    names = [p.name for p in index.find_plugins(searchpath)]
+    index.save()
+    assert "newplugin" not in names
+
+    # writing package.json only changes the mtime of newplugin itself
+    (newplugin / "package.json").write_text("{}")
+    mtime = newplugin.mtime + 10
+    os.utime(newplugin, (mtime, mtime))
+    index = plugins.PluginIndex(indexfile)
+    names = [p.name for p in index.find_plugins(searchpath)]
+    assert "newplugin" in names
+    assert sorted(names) == sorted(
+        [p.name for p in plugins.find_plugins(searchpath)])
@@ -0,0 +1,176 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+
+from StringIO import StringIO
+
+from dryice import tool
+from dryice.path import path
+from dryice.sourcemap import SourceMap, encode_vlq, decode_vlq, compose
+
+try:
+    from json import loads
+except ImportError:
+    from simplejson import loads
+
+plugindir = path(__file__).dirname() / "plugindir"
+pluginpath = [dict(name="pl", path=plugindir)]
+
+def test_vlq_roundtrip():
+    assert encode_vlq(0) == "A"
+    assert encode_vlq(1) == "C"
+    assert encode_vlq(-1) == "D"
+    assert encode_vlq(16) == "gB"
+    for value in [0, 1, -1, 15, 16, -16, 1000, -123456]:
+        encoded = encode_vlq(value)
+        assert decode_vlq(encoded + "A", 0) == (value, len(encoded))
+
+def test_sourcemap_json_roundtrip():
+    smap = SourceMap("out.js")
+    smap.add_lines(2, "a/one.js", 0, 3)
+    smap.add(5, 4, "b/two.js", 10, 2)
+    smap.source_contents["a/one.js"] = u"x\ny\nz"
+    data = smap.to_json()
+    assert data["version"] == 3
+    assert data["sources"] == ["a/one.js", "b/two.js"]
+    assert data["sourcesContent"] == [u"x\ny\nz", None]
+    assert data["mappings"] == ";;AAAA;AACA;AACA;ICQE"
+    loaded = SourceMap.from_json(data)
+    assert loaded.lines == smap.lines
+    assert loaded.lookup(3, 7) == ("a/one.js", 1, 7)
+    assert loaded.lookup(5, 3) is None
+    assert loaded.lookup(5, 6) == ("b/two.js", 10, 4)
+    assert loaded.lookup(100, 0) is None
+
+def test_compose():
+    # inner: the combined file, whose lines 10-19 are a.js
+    inner = SourceMap("combined.js")
+    inner.add_lines(10, "a.js", 0, 10)
+    # outer: a compressor squashed everything onto one line
+    outer = SourceMap("compressed.js")
+    outer.add(0, 0, "combined.js", 12, 4)
+    outer.add(0, 20, "combined.js", 3, 0)
+    outer.add(0, 30, "combined.js", 15, 0)
+    result = compose(outer, inner)
+    assert result.lookup(0, 2) == ("a.js", 2, 6)
+    # the segment for line 3 of combined.js leads nowhere
+    assert result.lookup(0, 25) == ("a.js", 2, 29)
+    assert result.lookup(0, 30) == ("a.js", 5, 0)
+
+def _check_mapped_lines(output, smap):
+    lines = output.split("\n")
+    checked = 0
+    for line_number, text in enumerate(lines):
+        found = smap.lookup(line_number, 0)
+        if found is None:
+            continue
+        source, source_line, column = found
+        original = path(smap.source_files[source]).text("utf8").split("\n")
+        assert text == original[source_line], (source, source_line)
+        checked += 1
+    return checked
+
+def test_generated_maps_point_at_original_lines():
+    manifest = tool.Manifest(plugins=["plugin1", "SingleFilePlugin1"],
+        search_path=pluginpath, include_tests=True, source_maps=True,
+        loader=plugindir / "SingleFilePlugin2.js")
+    output_js = StringIO()
+    output_main = StringIO()
+    output_worker = StringIO()
+    output_css = StringIO()
+    manifest.generate_output_files(output_js, output_main, output_worker,
+                                   output_css)
+    smap = manifest._sourcemaps["shared"]
+    assert "SingleFilePlugin2.js" in smap.sources
+    assert _check_mapped_lines(output_js.getvalue(), smap) > 0
+    smap = manifest._sourcemaps["main"]
+    assert "plugin1/thecode.js" in smap.sources
+    assert "plugin1/subdir/morecode.js" in smap.sources
+    assert "SingleFilePlugin1.js" in smap.sources
+    assert _check_mapped_lines(output_main.getvalue(), smap) > 10
+
+def test_no_tracking_without_source_maps():
+    outputs = []
+    for source_maps in (False, True):
+        manifest = tool.Manifest(plugins=["plugin1", "SingleFilePlugin1"],
+            search_path=pluginpath, include_tests=True,
+            source_maps=source_maps,
+            loader=plugindir / "SingleFilePlugin2.js")
+        files = [StringIO() for i in range(4)]
+        manifest.generate_output_files(*files)
+        outputs.append([f.getvalue() for f in files])
+        if not source_maps:
+            assert manifest._sourcemaps is None
+    assert outputs[0] == outputs[1]
+
+def test_build_writes_source_maps():
+    tmppath = path.getcwd() / "tmp" / "sourcemaps"
+    manifest = tool.Manifest(plugins=["plugin1"],
+        dynamic_plugins=["plugin2"], search_path=pluginpath,
+        include_tests=True, output_dir=tmppath, source_maps=True,
+        loader=plugindir / "SingleFilePlugin2.js")
+    manifest.build()
+    for name in ["BespinEmbedded.js", "plugins/plugin2.js"]:
+        f = tmppath / name
+        assert f.text().endswith("\n//# sourceMappingURL=%s.map\n"
+                                 % f.basename())
+        data = loads((f + ".map").text())
+        assert data["file"] == f.basename()
+        assert len(data["sources"]) == len(data["sourcesContent"])
+    data = loads((tmppath / "plugins" / "plugin2.js.map").text())
+    assert "plugin2/mycode.js" in data["sources"]
+
+def test_minified_build_maps_to_original_files():
+    tmppath = path.getcwd() / "tmp" / "minifiedmaps"
+    manifest = tool.Manifest(plugins=["plugin1", "SingleFilePlugin1"],
+        search_path=pluginpath, include_tests=True, output_dir=tmppath,
+        source_maps=True, loader=plugindir / "SingleFilePlugin2.js")
+    manifest.build()
+    manifest.compress_js()
+    main = tmppath / "BespinMain.js"
+    assert (tmppath / "BespinMain.uncompressed.js").exists()
+    assert (tmppath / "BespinMain.uncompressed.js.map").exists()
+    text = main.text("utf8")
+    assert "LICENSE" not in text
+    assert text.endswith("\n//# sourceMappingURL=BespinMain.js.map\n")
+
+    smap = SourceMap.from_json(loads((main + ".map").text()))
+    before = text[:text.index("exports.someFunction")].split("\n")
+    source, line, column = smap.lookup(len(before) - 1, len(before[-1]))
+    assert source == "SingleFilePlugin1.js"
+    original = (plugindir / "SingleFilePlugin1.js").text().split("\n")
+    assert original[line][column:].startswith("exports.someFunction")
@@ -0,0 +1,88 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+
+import base64
+
+from dryice.path import path
+from dryice.stylesheets import rewrite_urls, inline_images, minify, dedupe
+
+resources = path(__file__).dirname() / "plugindir" / "plugin1" / "resources"
+
+def test_rewrite_urls():
+    prefix = "resources/foo/"
+    assert rewrite_urls("a { background: url(images/a.png) }", "", prefix) \
+        == "a { background: url(resources/foo/images/a.png) }"
+    assert rewrite_urls("a { background: url( '../b.png' ) }", "css",
+                        prefix) == "a { background: url('resources/foo/b.png') }"
+    for url in ["http://example.com/a.png", "data:image/png;base64,AAAA",
+                "/a.png", "#icon", "../../a.png"]:
+        text = 'a { background: url("%s") }' % url
+        assert rewrite_urls(text, "css", prefix) == text
+
+def test_minify():
+    text = """/* gone */
+/*! kept */
+a:hover ,  b > i {
+    color : red ;
+    content: "a  ; /* b */ }";
+}
+p :first-child { margin: 0 auto; }
+"""
+    assert minify(text) == '/*! kept */ a:hover,b>i{color :red;' \
+        'content:"a  ; /* b */ }"}p :first-child{margin:0 auto}'
+
+def test_dedupe():
+    text = '@import "x.css";a{color:red}b{color:blue}a{color:red}' \
+        '@media print{a{color:red}}@import "x.css";'
+    assert dedupe(text) == '@import "x.css";b{color:blue}a{color:red}' \
+        '@media print{a{color:red}}@import "x.css";'
+
+def test_inline_images():
+    image = (resources / "images" / "prompt1.png").bytes()
+    inlined = 'a { background: url("data:image/png;base64,%s") }' \
+        % base64.b64encode(image)
+    text = "a { background: url(images/prompt1.png) }"
+    assert inline_images(text, "", resources, len(image)) == inlined
+    assert inline_images("a { background: url('../images/prompt1.png') }",
+                         "css", resources, len(image)) == inlined
+    assert inline_images(text, "", resources, len(image) - 1) == text
+    for url in ["images/missing.png", "foo.css", "images/prompt1.png#a",
+                "../../images/prompt1.png"]:
+        text = "a { background: url(%s) }" % url
+        assert inline_images(text, "", resources, 100000) == text
+
@@ -0,0 +1,101 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+
+import os
+
+from dryice.path import path
+from dryice.sync import Syncer
+
+def _make_tree(root):
+    if root.exists():
+        root.rmtree()
+    (root / "sub").makedirs()
+    (root / "a.txt").write_text("a")
+    (root / "b.css").write_text("b")
+    (root / "sub" / "c.txt").write_text("c")
+
+def _ignore_css(src, names):
+    return [name for name in names if name.endswith(".css")]
+
+def test_sync_tree():
+    tmppath = path.getcwd() / "tmp" / "sync"
+    source = tmppath / "source"
+    target = tmppath / "target"
+    _make_tree(source)
+
+    syncer = Syncer()
+    syncer.sync_tree(source, target, ignore=_ignore_css)
+    assert syncer.copied == 2
+    assert (target / "sub" / "c.txt").text() == "c"
+    assert not (target / "b.css").exists()
+
+    (source / "a.txt").write_text("changed")
+    os.utime(source / "a.txt", (0, 0))
+    (source / "sub" / "c.txt").remove()
+    (target / "b.css").write_text("stale")
+    (target / "extra").makedirs()
+    syncer = Syncer()
+    syncer.sync_tree(source, target, ignore=_ignore_css)
+    assert (syncer.copied, syncer.skipped, syncer.removed) == (1, 0, 3)
+    assert (target / "a.txt").text() == "changed"
+    assert sorted(target.listdir()) == [target / "a.txt", target / "sub"]
+    assert (target / "sub").listdir() == []
+
+    syncer = Syncer()
+    syncer.sync_tree(source, target, ignore=_ignore_css)
+    assert (syncer.copied, syncer.skipped, syncer.removed) == (0, 1, 0)
+
+def test_sync_tree_with_links():
+    tmppath = path.getcwd() / "tmp" / "synclinks"
+    source = tmppath / "source"
+    target = tmppath / "target"
+    _make_tree(source)
+    syncer = Syncer(link=True)
+    syncer.sync_tree(source, target)
+    if not hasattr(os, "link"):
+        assert syncer.copied == 3
+        return
+    assert syncer.linked == 3
+    assert os.stat(source / "a.txt").st_ino == os.stat(target / "a.txt").st_ino
+
+    # a changed file is replaced, never written through the link
+    (target / "a.txt").remove()
+    (target / "a.txt").write_text("different")
+    Syncer(link=True).sync_tree(source, target)
+    assert (source / "a.txt").text() == "a"
+    assert (target / "a.txt").text() == "a"
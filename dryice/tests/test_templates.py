@@ -0,0 +1,67 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+
+from dryice.templates import check_template, compile_templates
+
+def test_compile_templates():
+    module, problems = compile_templates({
+        "one.htmlt": "<div>${name}</div>",
+        "sub/two.htmlt": "<span onclick='${click}'>hi</span>"})
+    assert problems == []
+    assert "require('templater')" in module
+    assert "templater.compileAll(" in module
+    assert '"one.htmlt": "<div>${name}</div>"' in module
+    assert '"sub/two.htmlt"' in module
+
+def test_check_template():
+    assert check_template("<p if='${ok}' save='${node}'>${a} and ${b}</p>") \
+        == []
+    problems = check_template("<p>\n<a foreach='items'>${x</a></p>")
+    assert problems == [
+        "line 2: the value of foreach on <a> should look like ${...}",
+        "line 2: unterminated ${ in text"]
+    problems = check_template("<p title='${broken'>")
+    assert problems == ["line 1: unterminated ${ in title on <p>"]
+    # templater finds the reference anywhere in the value
+    assert check_template("<input save=' ${node}'>") == []
+
+def test_template_problems_are_reported():
+    module, problems = compile_templates({"bad.htmlt": "<p onclick='go'/>"})
+    assert problems == ["bad.htmlt, line 1: the value of onclick on <p> "
+                        "should look like ${...}"]
+    assert '"bad.htmlt"' in module
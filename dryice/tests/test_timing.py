@@ -0,0 +1,72 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+
+try:
+    from json import loads
+except ImportError:
+    from simplejson import loads
+
+from dryice.path import path
+from dryice.timing import Timings
+
+def test_phase_totals():
+    timings = Timings()
+    timings.add("combine", "plugin1", 0.5, 100)
+    timings.add("combine", "plugin2", 0.25, 50)
+    timings.add("find plugins", None, 1.0)
+    t = timings.start("compress js", "BespinMain.js")
+    timings.stop(t, 10)
+    phases = timings.phases()
+    assert phases[0] == ("find plugins", 1.0, None)
+    assert phases[1] == ("combine", 0.75, 150)
+    summary = timings.summary(top=1)
+    assert "combine" in summary
+    assert "plugin1" in summary
+    assert "plugin2" not in summary
+
+def test_report_file():
+    tmppath = path.getcwd() / "tmp"
+    if not tmppath.exists():
+        tmppath.makedirs()
+    timings = Timings()
+    timings.add("combine", "plugin1", 0.5, 100)
+    reportfile = tmppath / "timings.json"
+    timings.write(reportfile)
+    report = loads(reportfile.text())
+    assert report["phases"][0]["phase"] == "combine"
+    assert report["records"][0]["name"] == "plugin1"
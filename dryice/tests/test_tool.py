@@ -36,9 +36,13 @@
 
 from cStringIO import StringIO
 import codecs
+import gzip
+import os
+import re
 
 from dryice import tool
 from dryice.path import path
+from dryice.sourcemap import SourceMap
 
 plugindir = path(__file__).dirname() / "plugindir"
 pluginpath = [dict(name="pl", path=plugindir)]
@@ -257,6 +261,28 @@ def test_css_creation():
     assert "color: white" in output_css
     assert "background-image: url(resources/plugin1/images/prompt1.png);" in output_css
 
+def test_minified_css():
+    manifest = tool.Manifest(plugins=["plugin1"],
+        search_path=pluginpath, include_tests=True, minify_css=True,
+        loader=plugindir / "SingleFilePlugin2.js")
+    output_css = encsio()
+    manifest.generate_output_files(encsio(), encsio(), encsio(), output_css)
+    output_css = output_css.getvalue()
+    assert "color:white;" in output_css
+    assert "background-image:url(resources/plugin1/images/prompt1.png)}" \
+        in output_css
+    assert "inverse text" not in output_css
+
+def test_inlined_images():
+    manifest = tool.Manifest(plugins=["plugin1"],
+        search_path=pluginpath, include_tests=True, inline_images=1024,
+        loader=plugindir / "SingleFilePlugin2.js")
+    output_css = encsio()
+    manifest.generate_output_files(encsio(), encsio(), encsio(), output_css)
+    output_css = output_css.getvalue()
+    assert 'background-image: url("data:image/png;base64,' in output_css
+    assert "prompt1.png" not in output_css
+
 def test_full_output():
     tmppath = path.getcwd() / "tmp" / "testoutput"
     manifest = tool.Manifest(plugins=["text_editor"],
@@ -303,6 +329,19 @@ def test_get_dependencies():
     l = manifest.get_dependencies(pkgs, list("ceabd"))
     assert l == [a,b,c,d,e]
 
+def test_split_shared_keeps_order():
+    class MockPackage:
+        def __init__(self, name):
+            self.name = name
+
+    static = [MockPackage(name) for name in "zbyadx"]
+    worker = [MockPackage(name) for name in "yqaw"]
+    for i in range(10):
+        shared, static_only, worker_only = tool.split_shared(static, worker)
+        assert [p.name for p in shared] == list("ya")
+        assert [p.name for p in static_only] == list("zbdx")
+        assert [p.name for p in worker_only] == list("qw")
+
 def test_global_jquery_use():
     tmppath = path.getcwd() / "tmp" / "testoutput"
     manifest = tool.Manifest(plugins=["plugin1"],
@@ -312,4 +351,363 @@ def test_global_jquery_use():
     jsfile = tmppath / "BespinEmbedded.js"
     output = jsfile.text("utf8")
     assert "exports.$ = window.$;" in output
-    
\ No newline at end of file
+    
+def test_parallel_combining_matches_serial():
+    names = ["plugin1", "plugin2", "SingleFilePlugin1"]
+    serial = tool.Manifest(plugins=list(names), search_path=pluginpath,
+        include_tests=True)
+    parallel = tool.Manifest(plugins=list(names), search_path=pluginpath,
+        include_tests=True, jobs=2)
+    assert serial._combine_plugins(names) == parallel._combine_plugins(names)
+
+def test_streamed_output_matches_combined():
+    def build(name, jobs):
+        tmppath = path.getcwd() / "tmp" / name
+        if tmppath.exists():
+            tmppath.rmtree()
+        manifest = tool.Manifest(plugins=["plugin1", "SingleFilePlugin1"],
+            dynamic_plugins=["plugin2"], search_path=pluginpath,
+            include_tests=True, output_dir=tmppath, jobs=jobs,
+            source_maps=True, loader=plugindir / "SingleFilePlugin2.js")
+        outputs = [encsio() for i in range(4)]
+        manifest.generate_output_files(*outputs)
+        maps = manifest._sourcemaps
+        return ([o.getvalue() for o in outputs],
+                (tmppath / "plugins" / "plugin2.js").text(),
+                [maps[name].to_json(False) for name in
+                 ("shared", "main", "worker")])
+    streamed = build("streamed", 1)
+    combined = build("combined", 2)
+    assert streamed == combined
+
+def test_rebuild_syncs_resources():
+    tmppath = path.getcwd() / "tmp" / "resync"
+    if tmppath.exists():
+        tmppath.rmtree()
+    manifest = tool.Manifest(plugins=["plugin1"], search_path=pluginpath,
+        include_tests=True, output_dir=tmppath,
+        loader=plugindir / "SingleFilePlugin2.js")
+    manifest.build()
+    image = tmppath / "resources" / "plugin1" / "images" / "prompt1.png"
+    assert image.exists()
+    assert not (tmppath / "resources" / "plugin1" / "foo.css").exists()
+    stale = tmppath / "resources" / "oldplugin" / "old.png"
+    stale.dirname().makedirs()
+    stale.write_text("old")
+    (tmppath / "BespinMain.1234567890.js").write_text("old")
+    mtime = image.mtime
+    os.utime(image, (mtime - 100, mtime - 100))
+
+    manifest = tool.Manifest(plugins=["plugin1"], search_path=pluginpath,
+        include_tests=True, output_dir=tmppath,
+        loader=plugindir / "SingleFilePlugin2.js")
+    manifest.build()
+    # the image's time doesn't match the source's, so it was copied again
+    assert int(image.mtime) == int(mtime)
+    assert not (tmppath / "resources" / "oldplugin").exists()
+    assert not (tmppath / "BespinMain.1234567890.js").exists()
+    assert (tmppath / "BespinMain.js").exists()
+
+def test_server_rebuilds_into_previous_output():
+    class Options(object):
+        watch = False
+        jscompressor = None
+        csscompressor = None
+
+    tmppath = path.getcwd() / "tmp" / "serverrebuild"
+    if tmppath.exists():
+        tmppath.rmtree()
+    tmppath.makedirs()
+    output_dir = tmppath / "build"
+    manifest_file = tmppath / "manifest.json"
+    manifest_file.write_text(tool.dumps(dict(plugins=["plugin1"],
+        search_path=[plugindir], include_tests=True,
+        output_dir=output_dir, loader=plugindir / "SingleFilePlugin2.js")))
+
+    app = tool.DryIceAndWSGI(manifest_file, Options(), {})
+    app.build_overrides = {}
+    image = output_dir / "resources" / "plugin1" / "images" / "prompt1.png"
+    app.rebuild()
+    first = os.stat(image).st_ino
+    app.rebuild()
+    assert os.stat(image).st_ino != first
+    assert (output_dir + ".next").exists()
+    assert not (output_dir + ".old").exists()
+    # the third build goes into the output of the first, which only
+    # needs bringing up to date
+    app.rebuild()
+    assert os.stat(image).st_ino == first
+
+def test_compression_errors_are_collected():
+    tmppath = path.getcwd() / "tmp" / "compressfail"
+    if tmppath.exists():
+        tmppath.rmtree()
+    tmppath.makedirs()
+    manifest = tool.Manifest(plugins=["plugin1"], search_path=pluginpath,
+        output_dir=tmppath)
+    for name in ["one.js", "two.js"]:
+        f = tmppath / name
+        f.write_text("var x = 1;")
+        manifest._created_javascript.add(f)
+    try:
+        manifest.compress_js(tmppath / "nonexistent.jar", jobs=2)
+    except tool.BuildError, e:
+        message = str(e)
+        assert "one.js" in message
+        assert "two.js" in message
+    else:
+        assert False, "Expected a BuildError"
+    assert (tmppath / "one.js").exists()
+
+def test_server_keeps_connections_alive():
+    import threading
+    import httplib
+
+    def app(environ, start_response):
+        body = "hello from %s" % environ["PATH_INFO"]
+        start_response("200 OK", [("Content-Type", "text/plain"),
+                                  ("Content-Length", str(len(body)))])
+        return [body]
+
+    server = tool.make_server("localhost", 0, app,
+        server_class=tool.ThreadingWSGIServer,
+        handler_class=tool.KeepAliveRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    try:
+        conn = httplib.HTTPConnection("localhost", server.server_port)
+        conn.request("GET", "/one")
+        response = conn.getresponse()
+        assert response.read() == "hello from /one"
+        sock = conn.sock
+        conn.request("GET", "/two")
+        response = conn.getresponse()
+        assert response.read() == "hello from /two"
+        assert conn.sock is sock
+        conn.close()
+    finally:
+        server.shutdown()
+
+def test_precompressed_files():
+    tmppath = path.getcwd() / "tmp" / "precompress"
+    if tmppath.exists():
+        tmppath.rmtree()
+    tmppath.makedirs()
+    f = tmppath / "BespinMain.js"
+    f.write_text("var x = 1;\n" * 100)
+    tool.precompress_file(f)
+    gzfile = f + ".gz"
+    first = gzfile.bytes()
+    assert gzip.open(gzfile).read() == f.bytes()
+    tool.precompress_file(f)
+    assert gzfile.bytes() == first
+
+def test_accepted_encodings():
+    assert tool.accepted_encodings("gzip, deflate") == set(["gzip", "deflate"])
+    assert tool.accepted_encodings("br;q=1.0, gzip;q=0") == set(["br"])
+    assert tool.accepted_encodings("") == set()
+
+def test_server_sends_precompressed_files():
+    class Options(object):
+        watch = False
+
+    tmppath = path.getcwd() / "tmp" / "precompressserver"
+    if tmppath.exists():
+        tmppath.rmtree()
+    tmppath.makedirs()
+    f = tmppath / "BespinMain.js"
+    f.write_text("var x = 1;\n" * 100)
+    tool.precompress_file(f)
+    manifest_file = tmppath / "manifest.json"
+    manifest_file.write_text('{"output_dir": "%s"}' % tmppath)
+
+    app = tool.DryIceAndWSGI(manifest_file, Options(), {})
+    responses = []
+    def start_response(status, headers, exc_info=None):
+        responses.append((status, dict(headers)))
+
+    environ = dict(REQUEST_METHOD="GET", PATH_INFO="/BespinMain.js",
+                   HTTP_ACCEPT_ENCODING="gzip, deflate")
+    body = "".join(app(environ, start_response))
+    status, headers = responses[-1]
+    assert headers["Content-Encoding"] == "gzip"
+    assert headers["Content-Length"] == str((f + ".gz").size)
+    assert "javascript" in headers["Content-Type"]
+    assert body == (f + ".gz").bytes()
+
+    environ = dict(REQUEST_METHOD="GET", PATH_INFO="/BespinMain.js")
+    body = "".join(app(environ, start_response))
+    status, headers = responses[-1]
+    assert "Content-Encoding" not in headers
+    assert body == f.bytes()
+
+def test_combining_is_timed():
+    manifest = tool.Manifest(plugins=["plugin1"], search_path=pluginpath,
+        include_tests=True)
+    manifest._combine_plugins(["plugin1", "plugin2"])
+    names = [r["name"] for r in manifest.timings.records
+             if r["phase"] == "combine"]
+    assert names == ["plugin1", "plugin2"]
+    phases = [phase for phase, seconds, bytes in manifest.timings.phases()]
+    assert "find plugins" in phases
+
+def test_dynamic_plugin_css():
+    tmppath = path.getcwd() / "tmp" / "dynamiccss"
+    if tmppath.exists():
+        tmppath.rmtree()
+    manifest = tool.Manifest(dynamic_plugins=["plugin1"],
+        search_path=pluginpath, include_tests=True, output_dir=tmppath,
+        loader=plugindir / "SingleFilePlugin2.js")
+    output_main = encsio()
+    output_css = encsio()
+    manifest.generate_output_files(encsio(), output_main, encsio(),
+                                   output_css)
+    assert "color: white" not in output_css.getvalue()
+    plugin_css = tmppath / "plugins" / "plugin1.css"
+    assert "color: white" in plugin_css.text()
+    assert not (tmppath / "plugins" / "plugin2.css").exists()
+    main = output_main.getvalue()
+    assert "type: 'stylesheet'" in main
+    assert '"plugins/plugin1.css"' in main
+    assert main.count("type: 'stylesheet'") == 1
+    assert plugin_css in manifest._created_css
+
+def test_chunk_css_urls_resolve():
+    tmppath = path.getcwd() / "tmp" / "chunkcssurls"
+    if tmppath.exists():
+        tmppath.rmtree()
+    for names, stylesheet in [
+            (dict(dynamic_plugins=["plugin1"]), "plugins/plugin1.css"),
+            (dict(bundles=dict(one=["plugin1"])), "bundles/one.css"),
+            (dict(plugins=["plugin1"]), "BespinEmbedded.css")]:
+        stylesheet = tmppath / "build" / stylesheet
+        # the cache mustn't hand the CSS for one file to the other
+        manifest = tool.Manifest(search_path=pluginpath, include_tests=True,
+            output_dir=tmppath / "build", cache_dir=tmppath / "cache",
+            loader=plugindir / "SingleFilePlugin2.js", **names)
+        manifest.build()
+        urls = re.findall(r"url\(([^)]*prompt1.png)\)", stylesheet.text())
+        assert urls
+        for url in urls:
+            assert (stylesheet.dirname() / url).exists(), url
+
+def test_hoist_common():
+    class MockPackage:
+        def __init__(self, name):
+            self.name = name
+    a, b, c, d = [MockPackage(name) for name in "abcd"]
+    bundles = tool.hoist_common([("one", [a, b, c]), ("two", [b, d]),
+                                 ("three", [c])])
+    assert [(name, [p.name for p in packages])
+            for name, packages in bundles] == \
+        [("common", ["b", "c"]), ("one", ["a"]), ("two", ["d"]),
+         ("three", [])]
+    assert tool.hoist_common([("one", [a])]) == [("one", [a])]
+
+def test_bundles():
+    tmppath = path.getcwd() / "tmp" / "bundles"
+    if tmppath.exists():
+        tmppath.rmtree()
+    manifest = tool.Manifest(search_path=pluginpath, include_tests=True,
+        output_dir=tmppath, loader=plugindir / "SingleFilePlugin2.js",
+        bundles=dict(one=["plugin1"], two=["SingleFilePlugin1", "plugin2"]))
+    bundles = [(name, [p.name for p in packages])
+               for name, packages in manifest.bundle_packages]
+    assert bundles == [("common", ["plugin2"]), ("one", ["plugin1"]),
+                       ("two", ["SingleFilePlugin1"])]
+
+    output_main = encsio()
+    output_css = encsio()
+    manifest.generate_output_files(encsio(), output_main, encsio(),
+                                   output_css)
+    main = output_main.getvalue()
+    assert 'tiki.module("plugin1:thecode"' not in main
+    assert '"bundles/one.js"' in main
+    assert '"bundles/one.css"' in main
+    assert '"bundles/common.js"' in main
+    assert "color: white" not in output_css.getvalue()
+
+    one = (tmppath / "bundles" / "one.js").text()
+    assert 'tiki.module("plugin1:thecode"' in one
+    assert 'tiki.module("plugin2:mycode"' not in one
+    assert one.endswith('bespin.tiki.script("one.bundle.js");')
+    common = (tmppath / "bundles" / "common.js").text()
+    assert 'tiki.module("plugin2:mycode"' in common
+
+def test_empty_bundles_are_skipped():
+    tmppath = path.getcwd() / "tmp" / "emptybundles"
+    if tmppath.exists():
+        tmppath.rmtree()
+    # the page loads plugin1 already, so the bundle has nothing left in it
+    manifest = tool.Manifest(plugins=["plugin1"], search_path=pluginpath,
+        include_tests=True, output_dir=tmppath,
+        loader=plugindir / "SingleFilePlugin2.js",
+        bundles=dict(one=["plugin1"]))
+    assert manifest.bundle_packages == []
+    manifest.build()
+    assert not (tmppath / "bundles").exists()
+    assert "bundles/one.js" not in (tmppath / "BespinMain.js").text()
+
+def test_replaced_references_keep_source_maps():
+    tmppath = path.getcwd() / "tmp" / "replacemaps"
+    if tmppath.exists():
+        tmppath.rmtree()
+    tmppath.makedirs()
+    f = tmppath / "main.js"
+    f.write_bytes("load(\"plugins/a.js\"); go();\nload('plugins/a.js');\n")
+    smap = SourceMap()
+    smap.add(0, 0, "a.js", 0, 0)
+    smap.add(0, 22, "a.js", 0, 10)
+    smap.add(1, 0, "a.js", 1, 0)
+    (f + ".map").write_bytes(tool.dumps(smap.to_json()))
+
+    tool._replace_references(f, [("plugins/a.js", "plugins/a.12345.js")])
+    assert f.bytes() == ("load(\"plugins/a.12345.js\"); go();\n"
+                         "load('plugins/a.12345.js');\n")
+    smap = SourceMap.from_json(tool.loads((f + ".map").text()))
+    assert smap.lookup(0, 0) == ("a.js", 0, 0)
+    assert smap.lookup(0, 28) == ("a.js", 0, 10)
+    assert smap.lookup(1, 0) == ("a.js", 1, 0)
+
+def test_fingerprinted_output():
+    tmppath = path.getcwd() / "tmp" / "fingerprint"
+    manifest = tool.Manifest(plugins=["plugin1"],
+        dynamic_plugins=["plugin2"], search_path=pluginpath,
+        include_tests=True, output_dir=tmppath, source_maps=True,
+        precompress=True, fingerprint=True,
+        loader=plugindir / "SingleFilePlugin2.js")
+    manifest.build()
+    plugin_file = tmppath / "plugins" / "plugin2.js"
+    plugin_name = tool.fingerprinted_name(plugin_file).basename()
+
+    # precompressing waits until the output is final
+    assert not (plugin_file + ".gz").exists()
+    assets = manifest.fingerprint_output()
+    manifest.precompress_output()
+    assert assets["plugins/plugin2.js"] == "plugins/" + plugin_name
+    assert not plugin_file.exists()
+    assert not (plugin_file + ".gz").exists()
+    assert (tmppath / "plugins" / (plugin_name + ".gz")).exists()
+    assert (tmppath / "plugins" / (plugin_name + ".map")).exists()
+    for name in ["BespinEmbedded.js", assets["BespinEmbedded.js"],
+                 assets["BespinMain.js"]]:
+        f = tmppath / name
+        assert gzip.open(f + ".gz").read() == f.bytes()
+    precompressed = [r["name"] for r in manifest.timings.records
+                     if r["phase"] == "precompress"]
+    assert len(precompressed) == len(set(precompressed))
+
+    main_name = assets["BespinMain.js"]
+    main_text = (tmppath / main_name).text()
+    assert '"plugins/%s"' % plugin_name in main_text
+    assert main_text.endswith("//# sourceMappingURL=%s.map\n" % main_name)
+
+    embedded = (tmppath / "BespinEmbedded.js").text()
+    assert '"%s"' % main_name in embedded
+    assert '"%s"' % assets["BespinWorker.js"] in embedded
+    assert (tmppath / assets["BespinEmbedded.js"]).exists()
+    assert (tmppath / assets["BespinEmbedded.css"]).exists()
+
+    written = tool.loads((tmppath / "asset-manifest.json").text())
+    assert written == assets
@@ -0,0 +1,131 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+
+from StringIO import StringIO
+import codecs
+
+from dryice import tool, unused
+from dryice.path import path
+from dryice.unused import PluginInfo, find_unused, resolve
+
+plugindir = path(__file__).dirname() / "plugindir"
+pluginpath = [dict(name="pl", path=plugindir)]
+prunepath = [dict(name="prune", path=path(__file__).dirname() / "prunedir")]
+
+def encsio():
+    return codecs.getwriter("utf8")(StringIO())
+
+def test_resolve():
+    plugins = dict(a=PluginInfo({}, {"index": "", "util/x": ""}),
+                   b=PluginInfo({}, {"index": ""}))
+    assert resolve(plugins, "a", "index", "b:thing") == "b:thing"
+    assert resolve(plugins, "a", "index", "b") == "b:index"
+    assert resolve(plugins, "a", "index", "util/x") == "a:util/x"
+    assert resolve(plugins, "a", "util/x", "./y") == "a:util/y"
+    assert resolve(plugins, "a", "util/x", "../z") == "a:z"
+    assert resolve(plugins, "a", "index", "b/more") == "b:more"
+    assert resolve(plugins, "a", "index", "::b") == "b:index"
+    assert resolve(plugins, "a", "index", "nothere") is None
+
+def test_find_unused():
+    plugins = dict(
+        root=PluginInfo({}, {
+            "index": "var x = require('helper:used');",
+            "orphan": "",
+            "tests/testFoo": ""}),
+        helper=PluginInfo({}, {
+            "used": "require('./more');",
+            "more": "",
+            "notused": ""}),
+        dead=PluginInfo({}, {"index": "require('helper:notused');"}),
+        pointed=PluginInfo(dict(provides=[dict(ep="command",
+            pointer="cmds#run")]), {"cmds": "", "other": ""}),
+        styled=PluginInfo({}, {}, True),
+        dynamic=PluginInfo({}, {
+            "index": "require(name);", "a": "", "b": ""}),
+        booted=PluginInfo({}, {"index": ""}),
+        starter=PluginInfo(dict(dependencies={"needed": "0.0.0"}), {
+            "index": 'new WorkerSupervisor("worker:run#go");'}),
+        worker=PluginInfo({}, {"index": "", "run": "", "other": ""}),
+        needed=PluginInfo({}, {"index": "require('./util');", "util": "",
+                               "extra": ""}))
+    unused_plugins, unused_modules = find_unused(plugins,
+        ["root", "dynamic", "starter"],
+        ["bespin.tiki.require('booted:index');"])
+    assert unused_plugins == ["dead"]
+    assert unused_modules == dict(root=["orphan"], helper=["notused"],
+        pointed=["other"], worker=["other"], needed=["extra"])
+
+def test_prune_unused():
+    manifest = tool.Manifest(plugins=["plugin1"], search_path=pluginpath,
+        include_tests=True, prune_unused=True,
+        loader=plugindir / "SingleFilePlugin2.js")
+    main_js = encsio()
+    manifest.generate_output_files(encsio(), main_js, encsio(), encsio())
+    unused_plugins, unused_modules = manifest.unused_found
+    # plugin1 depends on plugin2, so plugin2 keeps its index module
+    assert unused_plugins == []
+    assert "thecode" in unused_modules["plugin1"]
+    assert unused_modules["plugin2"] == ["mycode"]
+    output = main_js.getvalue()
+    assert 'tiki.register("::plugin2"' in output
+    assert 'tiki.module("plugin2:mycode"' not in output
+    assert 'tiki.module("plugin2:index"' in output
+    assert 'tiki.module("plugin1:thecode"' not in output
+    assert 'tiki.module("plugin1:tests/testFoo"' in output
+
+def test_prune_keeps_what_is_used_indirectly():
+    manifest = tool.Manifest(plugins=["prunetest"], search_path=prunepath,
+        include_tests=True, prune_unused=True,
+        loader=plugindir / "SingleFilePlugin2.js")
+    main_js = encsio()
+    manifest.generate_output_files(encsio(), main_js, encsio(), encsio())
+    unused_plugins, unused_modules = manifest.unused_found
+    assert unused_plugins == []
+    assert unused_modules == dict(prunedep=["orphan"])
+    output = main_js.getvalue()
+    # the generated templates module needs templater
+    assert 'tiki.module("prunetest:templates"' in output
+    assert "exports.compile = function" in output
+    # reached through a "plugin#export" string
+    assert "exports.run = function" in output
+    # prunedep is a dependency of prunetest, so its index and what that
+    # needs stay
+    assert "exports.y = 1" in output
+    assert "exports.z = 2" not in output
+
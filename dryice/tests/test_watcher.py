@@ -0,0 +1,97 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+
+import time
+import threading
+
+from dryice.path import path
+from dryice.watcher import Watcher, snapshot
+
+tmppath = path.getcwd() / "tmp" / "watched"
+
+def setup():
+    if tmppath.exists():
+        tmppath.rmtree()
+    (tmppath / "plugin").makedirs()
+    (tmppath / "plugin" / "index.js").write_text("exports.a = 1;")
+
+def test_snapshot_sees_nested_files():
+    snap = snapshot([tmppath])
+    assert (tmppath / "plugin" / "index.js") in snap
+    assert snapshot([tmppath / "doesnotexist"]) == {}
+
+def test_polling_watcher_reports_changes():
+    changed = threading.Event()
+    watcher = Watcher([tmppath], changed.set, interval=0.05,
+                      use_inotify=False)
+    watcher.start()
+    try:
+        time.sleep(0.1)
+        assert not changed.isSet()
+        (tmppath / "plugin" / "other.js").write_text("exports.b = 2;")
+        changed.wait(2)
+        assert changed.isSet()
+    finally:
+        watcher.stop()
+
+def test_excluded_directories_are_ignored():
+    build = tmppath / "build"
+    build.makedirs()
+    (build / "BespinMain.js").write_text("var x;")
+    snap = snapshot([tmppath], exclude=[build])
+    assert (tmppath / "plugin" / "index.js") in snap
+    assert build not in snap
+    assert (build / "BespinMain.js") not in snap
+    assert snapshot([build], exclude=[build]) == {}
+
+    changed = threading.Event()
+    watcher = Watcher([tmppath], changed.set, interval=0.05,
+                      use_inotify=False, exclude=[build])
+    watcher.start()
+    try:
+        time.sleep(0.1)
+        (build / "BespinMain.js").write_text("var x, y;")
+        (build / "plugins").makedirs()
+        time.sleep(0.3)
+        assert not changed.isSet()
+        (tmppath / "plugin" / "index.js").write_text("exports.a = 2;")
+        changed.wait(2)
+        assert changed.isSet()
+    finally:
+        watcher.stop()
+        build.rmtree()
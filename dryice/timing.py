@@ -0,0 +1,124 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+"""Records where the time goes during a build."""
+
+import time
+
+try:
+    from json import dumps
+except ImportError:
+    from simplejson import dumps
+
+class Timings(object):
+    """Collects wall clock time (and optionally a byte count) for the
+    phases of a build. A phase is something like "combine", and each
+    record can also name the thing it was about, such as a plugin or an
+    output file."""
+
+    def __init__(self):
+        self.records = []
+
+    def start(self, phase, name=None):
+        """Starts timing. Pass the result to stop()."""
+        return (phase, name, time.time())
+
+    def stop(self, token, bytes=None):
+        """Records the time since start() was called."""
+        phase, name, started = token
+        self.add(phase, name, time.time() - started, bytes)
+
+    def add(self, phase, name, seconds, bytes=None):
+        self.records.append(dict(phase=phase, name=name, seconds=seconds,
+                                 bytes=bytes))
+
+    def phases(self):
+        """Returns a list of (phase, seconds, bytes) totals, slowest
+        first."""
+        totals = {}
+        order = []
+        for record in self.records:
+            phase = record["phase"]
+            if phase not in totals:
+                totals[phase] = [0.0, None]
+                order.append(phase)
+            total = totals[phase]
+            total[0] += record["seconds"]
+            if record["bytes"] is not None:
+                total[1] = (total[1] or 0) + record["bytes"]
+        result = [(phase, totals[phase][0], totals[phase][1])
+                  for phase in order]
+        result.sort(key=lambda item: -item[1])
+        return result
+
+    def report(self):
+        """Returns the timings as a JSON-serializable dictionary."""
+        return dict(
+            phases=[dict(phase=phase, seconds=seconds, bytes=bytes)
+                    for phase, seconds, bytes in self.phases()],
+            records=self.records
+        )
+
+    def write(self, filename):
+        """Writes the report to filename as JSON."""
+        f = open(filename, "w")
+        try:
+            f.write(dumps(self.report(), indent=2))
+        finally:
+            f.close()
+
+    def summary(self, top=10):
+        """Returns a human-readable summary of the phases and of the top
+        slowest individual records."""
+        def fmt_bytes(bytes):
+            if bytes is None:
+                return ""
+            return "%10d bytes" % bytes
+
+        lines = ["Build timings by phase:"]
+        for phase, seconds, bytes in self.phases():
+            lines.append("  %-24s %8.3fs %s" % (phase, seconds,
+                                               fmt_bytes(bytes)))
+
+        records = [r for r in self.records if r["name"] is not None]
+        records.sort(key=lambda r: -r["seconds"])
+        if records:
+            lines.append("Slowest steps:")
+            for r in records[:top]:
+                lines.append("  %-24s %-30s %8.3fs %s" % (r["phase"],
+                    r["name"], r["seconds"], fmt_bytes(r["bytes"])))
+        return "\n".join(lines)
@@ -37,19 +37,47 @@
 
 import sys
 import os
+import re
 import optparse
 import subprocess
 import codecs
-from wsgiref.simple_server import make_server
+import gzip
+import hashlib
+import time
+import threading
+import traceback
+import mimetypes
+import Queue
+import socket
+import SocketServer
+from StringIO import StringIO
+from BaseHTTPServer import BaseHTTPRequestHandler
+from wsgiref.simple_server import make_server, WSGIServer, \
+    WSGIRequestHandler, ServerHandler
 
 try:
     from json import loads, dumps
 except ImportError:
     from simplejson import loads, dumps
 
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 from dryice.path import path
 
-from dryice import plugins, combiner
+from dryice import plugins, combiner, analyze, unused, stylesheets, jsmin
+from dryice.sync import Syncer
+from dryice.cache import BuildCache, file_hash
+from dryice.watcher import Watcher
+from dryice.timing import Timings
+from dryice.sourcemap import SourceMap, TrackingWriter, compose
 
 class BuildError(Exception):
     def __init__(self, message, errors=None):
@@ -60,13 +88,214 @@ class BuildError(Exception):
         Exception.__init__(self, message)
                 
 
-sample_dir = path(__file__).dirname() / "samples"
-_boot_file = path(__file__).dirname() / "boot.js"
-_script2loader = path(__file__).dirname() / "script2loader.js"
+_dryice_dir = path(__file__).abspath().dirname()
+
+sample_dir = _dryice_dir / "samples"
+_boot_file = _dryice_dir / "boot.js"
+_script2loader = _dryice_dir / "script2loader.js"
 
 def ignore_css(src, names):
     return [name for name in names if name.endswith(".css")]
 
+def precompress_file(f):
+    """Writes f.gz (and f.br, if the brotli module is available) next to
+    f, so that a web server can send them to clients that accept those
+    encodings without compressing on the fly. The output only depends on
+    the contents of f."""
+    data = f.bytes()
+
+    gzfile = (f + ".gz").open("wb")
+    try:
+        # a fixed mtime and no filename keep the output reproducible
+        try:
+            gz = gzip.GzipFile("", "wb", 9, gzfile, 0)
+        except TypeError:
+            # Python < 2.7 can't set the mtime
+            gz = gzip.GzipFile("", "wb", 9, gzfile)
+        gz.write(data)
+        gz.close()
+    finally:
+        gzfile.close()
+
+    if brotli is not None:
+        (f + ".br").write_bytes(brotli.compress(data))
+
+def _source_map_comment(f):
+    return "\n//# sourceMappingURL=%s.map\n" % f.basename()
+
+def write_source_map(f, smap):
+    """Writes smap, the source map for the JavaScript file f, to f.map
+    and points to it from the end of f."""
+    smap.file = f.basename()
+    (f + ".map").write_bytes(dumps(smap.to_json()))
+    out = f.open("ab")
+    try:
+        out.write(_source_map_comment(f))
+    finally:
+        out.close()
+
+def _strip_source_map_comment(f, original):
+    """Removes the comment that write_source_map added to original from
+    the end of f."""
+    data = f.bytes()
+    comment = _source_map_comment(original)
+    if data.endswith(comment):
+        f.write_bytes(data[:-len(comment)])
+
+def split_shared(static_packages, worker_packages):
+    """Splits the packages needed by the main page and the worker into
+    those needed by both (which go into the shared file) and those needed
+    by just one of them. Each list keeps the order that it had in the
+    input, so the output files come out the same from build to build and
+    dependencies still come before the packages that need them."""
+    static_names = set([ p.name for p in static_packages ])
+    worker_names = set([ p.name for p in worker_packages ])
+    shared = [ p for p in static_packages if p.name in worker_names ]
+    static = [ p for p in static_packages if p.name not in worker_names ]
+    worker = [ p for p in worker_packages if p.name not in static_names ]
+    return shared, static, worker
+
+# how many hex digits of the content hash go into fingerprinted filenames
+_fingerprint_length = 10
+
+def fingerprinted_name(f):
+    """Returns the name that f gets when it is fingerprinted:
+    BespinMain.js becomes BespinMain.<hash of the content>.js."""
+    digest = hashlib.sha1(f.bytes()).hexdigest()[:_fingerprint_length]
+    base, ext = f.splitext()
+    return path("%s.%s%s" % (base, digest, ext))
+
+def _replace_references(f, renames):
+    """Replaces the quoted filenames in f according to the list of
+    (old name, new name) in renames. If f has a source map, the mappings
+    that come after a replaced name on the same line are moved along by
+    the difference in length, so that the map still fits."""
+    if not renames:
+        return
+    new_names = dict(renames)
+    reference = re.compile(r"""(["'])(%s)\1""" % "|".join(
+        [ re.escape(old) for old, new in renames ]))
+    lines = f.bytes().decode("utf8").split(u"\n")
+    mapfile = f + ".map"
+    smap = None
+    if mapfile.exists():
+        smap = SourceMap.from_json(loads(mapfile.text("utf8")))
+
+    changed = False
+    for i, line in enumerate(lines):
+        pieces = []
+        # (column that a replaced name ended at, change in length)
+        shifts = []
+        last = 0
+        for match in reference.finditer(line):
+            old = match.group(2)
+            new = new_names[old]
+            pieces.append(line[last:match.start(2)])
+            pieces.append(new)
+            last = match.end(2)
+            shifts.append((last, len(new) - len(old)))
+        if not shifts:
+            continue
+        pieces.append(line[last:])
+        lines[i] = u"".join(pieces)
+        changed = True
+        if smap is not None and i < len(smap.lines):
+            moved = []
+            for segment in smap.lines[i]:
+                offset = sum([ shift for end, shift in shifts
+                               if end <= segment[0] ])
+                moved.append((segment[0] + offset,) + tuple(segment[1:]))
+            smap.lines[i] = moved
+
+    if changed:
+        f.write_bytes(u"\n".join(lines).encode("utf8"))
+        if smap is not None:
+            mapfile.write_bytes(dumps(smap.to_json()))
+
+def hoist_common(bundles):
+    """Takes a list of (bundle name, packages) and moves the packages that
+    are in more than one of the bundles into a "common" bundle, which is
+    added to the front of the list if it is needed. The packages keep
+    their order."""
+    counts = {}
+    for name, packages in bundles:
+        for p in packages:
+            counts[p.name] = counts.get(p.name, 0) + 1
+
+    common = []
+    for name, packages in bundles:
+        for p in packages:
+            if counts[p.name] > 1 and p not in common:
+                common.append(p)
+
+    result = [ (name, [ p for p in packages if counts[p.name] == 1 ])
+               for name, packages in bundles ]
+    if common:
+        result.insert(0, ("common", common))
+    return result
+
+def _run_in_threads(func, items, jobs):
+    """Calls func for each of the items, using up to jobs threads at a
+    time. This is useful for work that mostly waits on subprocesses. If
+    func raises an exception, the first one is re-raised once all of the
+    threads are done."""
+    items = list(items)
+    jobs = max(1, min(jobs or 1, len(items)))
+    if jobs == 1:
+        for item in items:
+            func(item)
+        return
+
+    queue = Queue.Queue()
+    for item in items:
+        queue.put(item)
+    failures = []
+
+    def worker():
+        while True:
+            try:
+                item = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                func(item)
+            except Exception:
+                failures.append(sys.exc_info())
+
+    threads = [threading.Thread(target=worker) for i in range(jobs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if failures:
+        exc_type, exc_value, tb = failures[0]
+        raise exc_type, exc_value, tb
+
+def _print_template_problems(name, problems):
+    for problem in problems:
+        print "Warning: template problem in %s: %s" % (name, problem)
+
+def _combine_plugin_files(args):
+    """Combines one plugin into in-memory buffers and returns the
+    JavaScript and CSS, the source map segments, the problems found in
+    its templates and how long that took. This lives at module level so
+    that it can be handed to a multiprocessing pool."""
+    plugin, include_tests, exclude_modules, css_options = args
+    started = time.time()
+    js = StringIO()
+    css = StringIO()
+    segments = []
+    problems = []
+    combiner.combine_files(js, css, plugin, plugin.location,
+                           exclude_tests=not include_tests,
+                           segments=segments,
+                           exclude_modules=exclude_modules,
+                           template_problems=problems,
+                           **css_options)
+    return (js.getvalue(), css.getvalue(), segments, problems,
+            time.time() - started)
+
 class Manifest(object):
     """A manifest describes what should be built."""
     
@@ -76,7 +305,10 @@ class Manifest(object):
         dynamic_plugins=None, jquery="builtin",
         search_path=None, output_dir="build", include_sample=False,
         boot_file=None, unbundled_plugins=None, preamble=None, loader=None,
-        worker=None, config=None):
+        worker=None, config=None, cache_dir=None, jobs=1,
+        precompress=False, source_maps=False, fingerprint=False,
+        bundles=None, prune_unused=False, minify_css=False,
+        inline_images=0, link_resources=False):
         
         if plugins is None:
             plugins = []
@@ -88,6 +320,16 @@ class Manifest(object):
         plugins.insert(0, "bespin")
         self.plugins = plugins
         self.dynamic_plugins = dynamic_plugins
+
+        if bundles is None:
+            bundles = {}
+        if "common" in bundles:
+            raise BuildError("The bundle name 'common' is reserved for the "
+                "plugins that several bundles need")
+        self.bundles = bundles
+        self.prune_unused = prune_unused
+        # set to report what is unused without pruning it
+        self.report_unused = False
         
         self.jquery = jquery
 
@@ -131,7 +373,7 @@ will be deleted before the build.""")
         if unbundled_plugins:
             self.unbundled_plugins = path(unbundled_plugins).abspath()
 
-        self.preamble = path(__file__).dirname() / "preamble.js"
+        self.preamble = _dryice_dir / "preamble.js"
 
         def location_of(file, default_location):
             if default_location is not None:
@@ -151,8 +393,31 @@ will be deleted before the build.""")
             self.worker = path("lib") / "worker.js"
         
         self.config = config if config is not None else {}
+
+        if cache_dir:
+            self.build_cache = BuildCache(path(cache_dir).abspath())
+        else:
+            self.build_cache = None
+
+        self.jobs = jobs
+        self.precompress = precompress
+        self.source_maps = source_maps
+        self.fingerprint = fingerprint
+        self.minify_css = minify_css
+        self.inline_images = inline_images
+        self.link_resources = link_resources
+
         self._created_javascript = set()
+        self._created_css = set()
+        self._assets = None
+
+        self.timings = Timings()
+        t = self.timings.start("find plugins")
+        self.errors
+        self.timings.stop(t)
+        t = self.timings.start("dependencies")
         self._set_package_lists()
+        self.timings.stop(t)
 
     @classmethod
     def from_json(cls, json_string, overrides=None):
@@ -173,11 +438,18 @@ will be deleted before the build.""")
         return cls(**scrubbed_data)
     
     def _find_plugins(self):
-        self._plugin_catalog = dict((p.name, p) for p in plugins.find_plugins(self.search_path))
+        if self.build_cache is not None:
+            index = plugins.PluginIndex(self.build_cache.directory
+                                        / "plugin-index.json")
+            found = index.find_plugins(self.search_path)
+            index.save()
+        else:
+            found = plugins.find_plugins(self.search_path)
+        self._plugin_catalog = dict((p.name, p) for p in found)
         
         if self.jquery == "global":
             self._plugin_catalog['jquery'] = plugins.Plugin("jquery",
-                path(__file__).dirname() / "globaljquery.js",
+                _dryice_dir / "globaljquery.js",
                 dict(name="thirdparty"))
 
         errors = []
@@ -226,8 +498,23 @@ will be deleted before the build.""")
 
     def get_package(self, name):
         """Retrieve a combiner.Package by name."""
+        return self.dependency_graph.package(name)
+
+    def _make_package(self, name):
         plugin = self.get_plugin(name)
-        return combiner.Package(plugin.name, plugin.dependencies)
+        # sorted, so that the order doesn't depend on how the metadata
+        # dictionary happens to be laid out
+        return combiner.Package(plugin.name, sorted(plugin.dependencies))
+
+    @property
+    def dependency_graph(self):
+        """The combiner.DependencyGraph of the plugins in the catalog."""
+        try:
+            return self._dependency_graph
+        except AttributeError:
+            self._dependency_graph = combiner.DependencyGraph(
+                self._make_package)
+            return self._dependency_graph
 
     def generate_output_files(self, shared_js_file, main_js_file, 
             worker_js_file, css_file):
@@ -238,63 +525,171 @@ will be deleted before the build.""")
         static_packages = self.static_packages
         worker_packages = self.worker_packages
         dynamic_packages = self.dynamic_packages
+        bundle_packages = self.bundle_packages
+        bundle_package_list = []
+        for name, packages in bundle_packages:
+            bundle_package_list.extend(packages)
 
         if self.errors:
             raise BuildError("Errors found, stopping...", self.errors)
 
-        shared_js_file.write(self.preamble.text('utf8'))
-        shared_js_file.write(self.loader.text('utf8'))
+        # keep track of where everything lands in the output files, for
+        # the source maps. That is only worth doing when they are wanted.
+        source_maps = self.source_maps
+        if source_maps:
+            shared_js_file = TrackingWriter(shared_js_file)
+            main_js_file = TrackingWriter(main_js_file)
+            worker_js_file = TrackingWriter(worker_js_file)
+            self._sourcemaps = dict(shared=shared_js_file.sourcemap,
+                                    main=main_js_file.sourcemap,
+                                    worker=worker_js_file.sourcemap,
+                                    chunks={})
+        else:
+            self._sourcemaps = None
 
-        exclude_tests = not self.include_tests
+        def write_file(output, f, source):
+            text = f.text("utf8")
+            if source_maps:
+                output.write_file(text, source, f)
+            else:
+                output.write(text)
+
+        write_file(shared_js_file, self.preamble, "dryice/preamble.js")
+        write_file(shared_js_file, self.loader, self.loader.basename())
+
+        # with a single job, no cache and nothing to prune, each plugin is
+        # combined straight into the file it ends up in, so only one
+        # plugin's CSS is held at a time. Otherwise, combine all of the
+        # plugins up front (possibly in parallel), then write them out in
+        # order below
+        if (self.jobs or 1) <= 1 and self.build_cache is None \
+                and not (self.prune_unused or self.report_unused):
+            combined = None
+        else:
+            combined = self._combine_plugins([package.name for package in
+                shared_packages + dynamic_packages + bundle_package_list
+                + static_packages + worker_packages])
+        self._combined = combined
+
+        if self.prune_unused or self.report_unused:
+            t = self.timings.start("unused")
+            self._check_unused(combined)
+            self.timings.stop(t)
 
         # finally, package up the plugins
 
-        def process(package, output, dynamic):
+        def write_js(output, plugin):
+            """Writes the plugin's JavaScript to output and returns its
+            CSS."""
+            if source_maps:
+                start = output.line
+                column = output.column
+            if combined is None:
+                css = StringIO()
+                segments = None
+                if source_maps:
+                    segments = []
+                problems = []
+                t = self.timings.start("combine", plugin.name)
+                combiner.combine_files(output, css, plugin, plugin.location,
+                    exclude_tests=not self.include_tests,
+                    segments=segments, template_problems=problems,
+                    **self._css_options(plugin.name))
+                _print_template_problems(plugin.name, problems)
+                css = css.getvalue()
+                self.timings.stop(t)
+            else:
+                js, css, segments = combined[plugin.name]
+                output.write(js)
+            if source_maps:
+                for source, filename, line, count in segments:
+                    output.sourcemap.add_lines(start + line, source, 0,
+                        count, filename, 0 if line else column)
+            return css
+
+        def process(package, output):
             plugin = self.get_plugin(package.name)
-            if dynamic:
-                plugin_subdir = path("plugins")
-                plugin_dir = output_dir / plugin_subdir
-                if not plugin_dir.isdir():
-                    plugin_dir.makedirs()
-                plugin_filename = package.name + ".js"
-                plugin_location = plugin_subdir / plugin_filename
-                self._created_javascript.add(plugin_location)
-                combine_output_path = plugin_dir / plugin_filename
-                combine_output = combine_output_path.open("w")
+            combiner.write_metadata(output, plugin)
+            main_css.append(write_js(output, plugin))
+
+        def finish_css(pieces):
+            css = u"".join(pieces)
+            if self.minify_css:
+                css = stylesheets.dedupe(css)
+            return css
+
+        def write_chunk(location, resource_id, packages, output):
+            """Writes packages that are loaded on demand to their own file
+            at location (relative to the output directory), with their CSS
+            next to it rather than in the main CSS file. output gets their
+            metadata, which points tiki at those files."""
+            chunk_path = output_dir / location
+            chunk_dir = chunk_path.dirname()
+            if not chunk_dir.isdir():
+                chunk_dir.makedirs()
+            self._created_javascript.add(chunk_path)
+            self._chunks.append(location)
+
+            chunk_output = chunk_path.open("w")
+            if source_maps:
+                chunk_output = TrackingWriter(chunk_output)
+                self._sourcemaps["chunks"][chunk_path] = \
+                    chunk_output.sourcemap
+            try:
+                css = finish_css([ write_js(chunk_output,
+                                            self.get_plugin(package.name))
+                                   for package in packages ])
+                chunk_output.write("bespin.tiki.script(%s);" %
+                    dumps(resource_id))
+            finally:
+                chunk_output.close()
+
+            if css:
+                stylesheet_location = location.splitext()[0] + ".css"
+                css_path = output_dir / stylesheet_location
+                self._created_css.add(css_path)
+                chunk_css_file = codecs.open(css_path, "w", "utf8")
+                try:
+                    chunk_css_file.write(css)
+                finally:
+                    chunk_css_file.close()
             else:
-                plugin_location = None
-                combine_output = output
+                stylesheet_location = None
 
-            combiner.write_metadata(output, plugin, plugin_location)
-            
-            combiner.combine_files(combine_output, css_file, plugin,
-                                   plugin.location,
-                                   exclude_tests=exclude_tests,
-                                   image_path_prepend="resources/%s/"
-                                                      % plugin.name)
-            if dynamic:
-                combine_output.write("bespin.tiki.script(%s);" %
-                    dumps(plugin_filename))
-        
+            for package in packages:
+                combiner.write_metadata(output, self.get_plugin(package.name),
+                    location, stylesheet_location, resource_id)
+
+        self._chunks = []
+        main_css = []
         for package in shared_packages:
-            process(package, shared_js_file, False)
+            process(package, shared_js_file)
         for package in dynamic_packages:
-            process(package, main_js_file, True)
+            plugin_filename = package.name + ".js"
+            write_chunk(path("plugins") / plugin_filename, plugin_filename,
+                        [package], main_js_file)
+        for name, packages in bundle_packages:
+            write_chunk(path("bundles") / (name + ".js"),
+                        name + ".bundle.js", packages, main_js_file)
         for package in static_packages:
-            process(package, main_js_file, False)
+            process(package, main_js_file)
 
         def make_plugin_metadata(packages):
+            t = self.timings.start("metadata")
             md = dict()
             for p in packages:
                 plugin = self.get_plugin(p.name)
                 md[plugin.name] = plugin.metadata
-            return dumps(md)
+            result = dumps(md, sort_keys=True)
+            self.timings.stop(t, len(result))
+            return result
 
         # include plugin metadata
         # this comes after the plugins, because some plugins
         # may need to be importable at the time the metadata
         # becomes available.
-        all_packages = static_packages + dynamic_packages + worker_packages
+        all_packages = (static_packages + dynamic_packages
+                        + bundle_package_list + worker_packages)
         all_md = make_plugin_metadata(all_packages)
         bundled_plugins = set([ p.name for p in all_packages ])
         self.bundled_plugins = bundled_plugins
@@ -322,32 +717,163 @@ bespin.tiki.require("bespin:plugins").catalog.registerMetadata(%s);
             main_js_file.write(boot_text.encode("utf8"))
 
         for package in worker_packages:
-            process(package, worker_js_file, False)
+            process(package, worker_js_file)
 
         worker_md = make_plugin_metadata(worker_packages)
         worker_js_file.write("bespin.metadata = %s;" % worker_md)
 
-        worker_js_file.write(self.worker.text("utf8"))
+        write_file(worker_js_file, self.worker, self.worker.basename())
+
+        css_file.write(finish_css(main_css))
+
+    def find_unused(self, combined):
+        """Returns the plugins and modules that nothing in the build uses,
+        as described in unused.find_unused. combined is the output of
+        _combine_plugins for all of the packages in the build."""
+        infos = {}
+        for name, (js, css, segments) in combined.items():
+            plugin = self.get_plugin(name)
+            modules = unused.split_modules(name, js, segments)
+            # the templates module is generated, so it has no segment
+            template_module = plugin.template_module
+            if template_module:
+                modules["templates"] = template_module
+            infos[name] = unused.PluginInfo(plugin.metadata, modules,
+                                            bool(css.strip()))
+        roots = self.plugins + self.dynamic_plugins + self.worker_plugins
+        for name in sorted(self.bundles):
+            roots = roots + self.bundles[name]
+        scripts = [ f.text("utf8") for f in [self.boot_file, self.worker]
+                    if f and f.exists() ]
+        return unused.find_unused(infos, roots, scripts)
+
+    def _check_unused(self, combined):
+        """Reports what nothing uses and, if prune_unused is set, combines
+        the affected plugins again without it. An unused plugin keeps its
+        registration and metadata, so that the dependencies of other
+        plugins are still satisfied, but loses all of its modules."""
+        unused_plugins, unused_modules = self.find_unused(combined)
+        self.unused_found = (unused_plugins, unused_modules)
+        if unused_plugins:
+            print "Plugins that nothing uses: %s" % ", ".join(unused_plugins)
+        if unused_modules:
+            print "Modules that nothing uses:"
+            for name in sorted(unused_modules):
+                for module in unused_modules[name]:
+                    print "    %s:%s" % (name, module)
+        if not self.prune_unused:
+            return
+
+        excluded = dict(unused_modules)
+        for name in unused_plugins:
+            js, css, segments = combined[name]
+            excluded[name] = unused.split_modules(name, js, segments).keys()
+        for name in sorted(excluded):
+            plugin = self.get_plugin(name)
+            js, css, segments, problems, seconds = _combine_plugin_files(
+                (plugin, self.include_tests, set(excluded[name]),
+                 self._css_options(name)))
+            combined[name] = (js, css, segments)
+            self.timings.add("prune", name, seconds, len(js))
+
+    def output_layout(self):
+        """Returns a list of (filename, packages) for each of the
+        JavaScript files that the build writes plugins to, with the
+        filename relative to the output directory."""
+        layout = [("BespinEmbedded.js", self.shared_packages),
+                  ("BespinMain.js", self.static_packages),
+                  ("BespinWorker.js", self.worker_packages)]
+        for package in self.dynamic_packages:
+            layout.append(("plugins/%s.js" % package.name, [package]))
+        for name, packages in self.bundle_packages:
+            layout.append(("bundles/%s.js" % name, packages))
+        return layout
+
+    def _css_options(self, name):
+        """The options for processing the named plugin's CSS, as passed on
+        to combiner.combine_files. Image urls are resolved against the
+        stylesheet they end up in, and the CSS of plugins that are loaded
+        on demand goes next to their JavaScript, a directory below the
+        resources."""
+        image_path_prepend = "resources/%s/" % name
+        chunked = [ p.name for p in self.dynamic_packages ]
+        for bundle_name, packages in self.bundle_packages:
+            chunked.extend([ p.name for p in packages ])
+        if name in chunked:
+            image_path_prepend = "../" + image_path_prepend
+        return dict(image_path_prepend=image_path_prepend,
+                    minify_css=self.minify_css, css_cache=self.build_cache,
+                    inline_images=self.inline_images)
+
+    def _combine_plugin(self, plugin):
+        """Returns the combined JavaScript and CSS for a plugin."""
+        return self._combine_plugins([plugin.name])[plugin.name][:2]
+
+    def _combine_plugins(self, names):
+        """Returns a dictionary mapping each of the named plugins to its
+        combined JavaScript and CSS, along with the source map segments
+        that combiner.combine_files reported. If the manifest has a cache_dir, the
+        output is reused from the cache as long as none of the plugin's
+        files have changed. Plugins that do need to be combined are
+        spread over self.jobs worker processes."""
+        cache = self.build_cache
+        include_tests = self.include_tests
+        result = {}
+        keys = {}
+        slots = {}
+        todo = []
+        for name in names:
+            plugin = self.get_plugin(name)
+            css_options = self._css_options(name)
+            if cache is not None:
+                key_parts = (plugin, include_tests,
+                             css_options["image_path_prepend"],
+                             self.minify_css, self.inline_images)
+                key = cache.plugin_key(*key_parts)
+                t = self.timings.start("combine (cached)", name)
+                cached = cache.get("plugins", key)
+                if cached is not None:
+                    result[name] = (cached["js"], cached["css"],
+                                    cached["segments"])
+                    # so that they aren't lost once the plugin is cached
+                    _print_template_problems(name, cached["problems"])
+                    self.timings.stop(t, len(cached["js"])
+                                         + len(cached["css"]))
+                    continue
+                keys[name] = key
+                slots[name] = cache.plugin_slot(*key_parts)
+            todo.append((plugin, include_tests, None, css_options))
+
+        jobs = min(self.jobs or 1, len(todo))
+        if jobs > 1 and multiprocessing is not None:
+            pool = multiprocessing.Pool(jobs)
+            try:
+                combined = pool.map(_combine_plugin_files, todo)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            combined = [_combine_plugin_files(args) for args in todo]
+
+        for args, (js, css, segments, problems, seconds) in zip(todo,
+                                                                combined):
+            plugin = args[0]
+            result[plugin.name] = (js, css, segments)
+            _print_template_problems(plugin.name, problems)
+            self.timings.add("combine", plugin.name, seconds,
+                             len(js) + len(css))
+            if cache is not None:
+                cache.put("plugins", keys[plugin.name],
+                          dict(js=js, css=css, segments=segments,
+                               problems=problems),
+                          slot=slots[plugin.name])
+        return result
 
     def get_dependencies(self, packages, root_names):
         """Given a dictionary of package names to packages, returns the list of
         root packages and all their dependencies, topologically sorted."""
-        visited = set()
-        result = []
-        def visit(name):
-            if name in visited:
-                return
-            visited.add(name)
-
-            pkg = packages[name]
-            for dep_name in pkg.dependencies:
-                visit(dep_name)
-            result.append(pkg)
-
-        for name in root_names:
-            visit(name)
-
-        return result
+        graph = combiner.DependencyGraph(packages.__getitem__)
+        return graph.sort(root_names)
 
     def _set_package_lists(self):
         """Returns a tuple consisting of the dynamic plugins, the static
@@ -359,42 +885,36 @@ bespin.tiki.require("bespin:plugins").catalog.registerMetadata(%s);
         plugins = self.plugins
         worker_plugins = self.worker_plugins
         dynamic_plugins = self.dynamic_plugins
-        
+        graph = self.dependency_graph
         
         # Filter the packages into static and dynamic parts. If a package is
         # dynamically loaded, all of its dependencies must also be dynamically
         # loaded.
-        def closure(plugins):
-            to_visit = plugins
-            pkgs = {}
-            for name in to_visit:
-                if name in pkgs:
-                    continue
-                pkg = self.get_package(name)
-                pkgs[name] = pkg
-                to_visit += pkg.dependencies
-            return pkgs
+        try:
+            dynamic_packages = graph.sort(dynamic_plugins)
+            deps = graph.sort(plugins)
+            worker_packages = graph.sort(worker_plugins)
+            bundles = [ (name, graph.sort(self.bundles[name]))
+                        for name in sorted(self.bundles) ]
+        except combiner.CombinerError, e:
+            self._errors.append(str(e))
+            return
 
-        pkgs = closure(dynamic_plugins + plugins)
-        dynamic_packages = self.get_dependencies(pkgs, dynamic_plugins)
         dynamic_names = set([ pkg.name for pkg in dynamic_packages ])
-
-        deps = self.get_dependencies(pkgs, plugins)
         static_packages = [ p for p in deps if p.name not in dynamic_names ]
 
-        pkgs = closure(worker_plugins)
-        worker_packages = self.get_dependencies(pkgs, worker_plugins)
+        # bundles don't need to carry what the page has loaded already
+        loaded = set([ p.name for p in deps ]).union(dynamic_names)
+        bundles = [ (name, [ p for p in packages if p.name not in loaded ])
+                    for name, packages in bundles ]
         
-        static_set = set(static_packages)
-        worker_set = set(worker_packages)
-        shared_set = static_set.intersection(worker_set)
-        worker_set.difference_update(shared_set)
-        static_set.difference_update(shared_set)
-        
-        self.shared_packages = list(shared_set)
-        self.static_packages = list(static_set)
-        self.worker_packages = list(worker_set)
+        (self.shared_packages, self.static_packages,
+         self.worker_packages) = split_shared(static_packages, worker_packages)
         self.dynamic_packages = dynamic_packages
+        # a bundle can end up with nothing in it, and then there is
+        # nothing to load
+        self.bundle_packages = [ (name, packages) for name, packages
+                                 in hoist_common(bundles) if packages ]
         
     def _output_unbundled_plugins(self, output_dir):
         if not output_dir.exists():
@@ -404,15 +924,20 @@ bespin.tiki.require("bespin:plugins").catalog.registerMetadata(%s);
                 raise BuildError("Unbundled plugins can't go in %s because it's not a directory" % output_dir)
 
         bundled_plugins = self.bundled_plugins
-        for name, plugin in self._plugin_catalog.items():
+        syncer = Syncer(self.link_resources)
+        names = []
+        for name, plugin in sorted(self._plugin_catalog.items()):
             if name in bundled_plugins:
                 continue
             location = plugin.location
+            names.append(location.basename())
             if location.isdir():
-                location.copytree(output_dir / location.basename())
+                syncer.sync_tree(location, output_dir / location.basename())
             else:
-                location.copy(output_dir / location.basename())
-        print "Unbundled plugins placed in: %s" % output_dir
+                syncer.sync_file(location, output_dir / location.basename())
+        syncer.remove_others(output_dir, names)
+        print "Unbundled plugins placed in: %s (%s)" % (output_dir,
+                                                        syncer.summary())
                 
 
     def build(self):
@@ -421,12 +946,23 @@ bespin.tiki.require("bespin:plugins").catalog.registerMetadata(%s);
         if self.errors:
             raise BuildError("Errors found, stopping...", self.errors)
         
+        timings = self.timings
         output_dir = self.output_dir
         print "Placing output in %s" % output_dir
+        t = timings.start("clean output")
         if output_dir.exists():
-            output_dir.rmtree()
-
-        output_dir.makedirs()
+            # the resources and samples are synced below rather than
+            # copied again from scratch
+            for f in output_dir.listdir():
+                if f.basename() not in ("resources", "samples") \
+                        or not f.isdir():
+                    if f.isdir():
+                        f.rmtree()
+                    else:
+                        f.remove()
+        else:
+            output_dir.makedirs()
+        timings.stop(t)
 
         filenames = [
             output_dir / f for f in
@@ -436,57 +972,268 @@ bespin.tiki.require("bespin:plugins").catalog.registerMetadata(%s);
         self._created_javascript.add(filenames[0])
         self._created_javascript.add(filenames[1])
         self._created_javascript.add(filenames[2])
+        self._created_css.add(filenames[3])
         
         files = [ codecs.open(f, 'w', 'utf8') for f in filenames ]
         [ jsfile, mainfile, workerfile, cssfile ] = files
         self.generate_output_files(jsfile, mainfile, workerfile, cssfile)
         for f in files:
             f.close()
+        if self.source_maps:
+            t = timings.start("source maps")
+            maps = self._sourcemaps
+            for f, kind in zip(filenames, ["shared", "main", "worker"]):
+                write_source_map(f, maps[kind])
+            for f, smap in maps["chunks"].items():
+                write_source_map(f, smap)
+            timings.stop(t)
+        for f in filenames:
+            timings.add("output size", f.basename(), 0.0, f.size)
         
         if self.unbundled_plugins:
+            t = timings.start("unbundled plugins")
             self._output_unbundled_plugins(self.unbundled_plugins)
-
-        for package in self.static_packages + self.dynamic_packages + self.worker_packages + self.shared_packages:
+            timings.stop(t)
+
+        bundle_packages = []
+        for name, packages in self.bundle_packages:
+            bundle_packages.extend(packages)
+        syncer = Syncer(self.link_resources)
+        resources_dir = output_dir / "resources"
+        synced = []
+        for package in self.static_packages + self.dynamic_packages + self.worker_packages + self.shared_packages + bundle_packages:
             plugin = self.get_plugin(package.name)
             resources = plugin.location / "resources"
             if resources.exists() and resources.isdir():
-                resources.copytree(output_dir / "resources" / plugin.name,
+                t = timings.start("copy resources", plugin.name)
+                syncer.sync_tree(resources, resources_dir / plugin.name,
                     ignore=ignore_css)
-
+                synced.append(plugin.name)
+                timings.stop(t)
+        if synced:
+            syncer.remove_others(resources_dir, synced)
+        elif resources_dir.exists():
+            resources_dir.rmtree()
+
+        samples = output_dir / "samples"
         if self.include_sample:
-            sample_dir.copytree(output_dir / "samples")
+            t = timings.start("samples")
+            syncer.sync_tree(sample_dir, samples)
+            timings.stop(t)
+        elif samples.exists():
+            samples.rmtree()
+        print "Resources: %s" % syncer.summary()
+
+    def compress_js(self, compressor=None, jobs=None):
+        """Compress the output using Closure Compiler, or with dryice's
+        own minifier if no compressor is given. Up to jobs files
+        (by default, the manifest's jobs setting) are compressed at once.
+        All of the files are attempted, and any failures are reported
+        together in a single BuildError.
+
+        If the manifest has a cache_dir, files that have been compressed
+        before with the same compiler are restored from the cache. (The
+        minifier is quick enough that its output isn't cached.)
+
+        Files that have a source map get a new one, composed from
+        Closure's map of the compressed file and the existing map, and
+        the existing one moves along with the file to .uncompressed.js."""
+        if jobs is None:
+            jobs = self.jobs
+        flags = "--warning_level=QUIET"
+        cache = self.build_cache
+        if compressor is None:
+            cache = None
+        if cache is not None:
+            compressor_hash = file_hash(path(compressor))
+        errors = []
 
-    def compress_js(self, compressor):
-        """Compress the output using Closure Compiler."""
-        for f in self._created_javascript:
-            print "Compressing %s" % (f)
+        def compress(f):
             compressed = f + ".compressed"
-            subprocess.call("java -jar %s "
-                "--js=%s"
-                " --js_output_file=%s"
-                " --warning_level=QUIET" % (compressor, f, f + ".compressed"),
-                shell=True)
-            if compressed.size == 0:
-                raise BuildError("File %s did not compile correctly. Check for errors." % (f))
+            mapfile = f + ".map"
+            compressed_map = f + ".compressed.map"
+            has_map = self.source_maps and mapfile.exists()
+            if has_map:
+                map_flags = (" --create_source_map=%s"
+                             " --source_map_format=V3" % compressed_map)
+            else:
+                map_flags = ""
+            if cache is not None:
+                # the map's filename is left out, as it varies by build
+                key = cache.key("closure", file_hash(f), compressor_hash,
+                    flags + (" --create_source_map" if has_map else ""))
+                cached = cache.get_file("compressed", key)
+                if has_map:
+                    cached_map = cache.get_file("compressed-maps", key)
+                    if cached_map is None:
+                        cached = None
+            else:
+                cached = None
+
+            t = self.timings.start("compress js", f.basename())
+            if cached is not None:
+                print "Using cached compressed %s" % (f)
+                cached.copyfile(compressed)
+                if has_map:
+                    cached_map.copyfile(compressed_map)
+            elif compressor is None:
+                print "Minifying %s" % (f)
+                if has_map:
+                    minified_map = SourceMap()
+                else:
+                    minified_map = None
+                try:
+                    minified = jsmin.minify(f.text("utf8"), minified_map,
+                                            f.basename())
+                except jsmin.MinifyError, e:
+                    errors.append("Unable to minify %s: %s" % (f, e))
+                    return
+                compressed.write_bytes(minified.encode("utf8"))
+                if has_map:
+                    compressed_map.write_bytes(dumps(
+                        minified_map.to_json(include_content=False)))
+            else:
+                print "Compressing %s" % (f)
+                subprocess.call("java -jar %s "
+                    "--js=%s"
+                    " --js_output_file=%s"
+                    " %s%s" % (compressor, f, compressed, flags, map_flags),
+                    shell=True)
+                if not compressed.exists() or compressed.size == 0:
+                    errors.append("File %s did not compile correctly. "
+                                  "Check for errors." % (f))
+                    return
+                if has_map and not compressed_map.exists():
+                    errors.append("No source map was created for %s" % (f))
+                    return
+                if cache is not None:
+                    cache.put_file("compressed", key, compressed)
+                    if has_map:
+                        cache.put_file("compressed-maps", key,
+                                       compressed_map)
+
+            self.timings.stop(t, compressed.size)
             newname = f.splitext()[0] + ".uncompressed.js"
             f.rename(newname)
             compressed.rename(f)
-            
+            if has_map:
+                smap = SourceMap.from_json(loads(mapfile.text("utf8")))
+                closure_map = SourceMap.from_json(
+                    loads(compressed_map.text("utf8")))
+                compressed_map.remove()
+                _strip_source_map_comment(newname, f)
+                write_source_map(newname, smap)
+                write_source_map(f, compose(closure_map, smap))
+
+        _run_in_threads(compress, sorted(self._created_javascript), jobs)
+        if errors:
+            errors.sort()
+            raise BuildError("Compression failed", errors)
+
+    def compress_css(self, compressor=None):
+        """Compress the CSS (BespinEmbedded.css and the stylesheets of
+        dynamic plugins) using YUI Compressor, or by minifying it with
+        dryice's own CSS processing if no compressor is given."""
+        if compressor is None:
+            print "Minifying CSS"
+        else:
+            print "Compressing CSS with YUI Compressor"
+            compressor = path(compressor).abspath()
+        for uncompressed in sorted(self._created_css):
+            t = self.timings.start("compress css", uncompressed.basename())
+            base = uncompressed.splitext()[0]
+            compressed = path(base + ".compressed.css")
+            if compressor is None:
+                css = stylesheets.minify(uncompressed.text("utf8"))
+                compressed.write_bytes(
+                    stylesheets.dedupe(css).encode("utf8"))
+            else:
+                subprocess.call("java -jar %s"
+                    " --type css -o %s"
+                    " %s" % (compressor, compressed.basename(),
+                             uncompressed.basename()), shell=True,
+                    cwd=uncompressed.dirname())
+            if not compressed.exists():
+                raise BuildError("Unable to compress the css file at " + uncompressed)
+            self.timings.stop(t, compressed.size)
+            uncompressed.rename(base + ".uncompressed.css")
+            compressed.rename(uncompressed)
+
+    def fingerprint_output(self):
+        """Puts a hash of their content into the names of the output files,
+        so that they can be served with far-future expiry dates. This
+        runs after compression, as it needs the final content.
+
+        The dynamic plugins and bundles, and their stylesheets, are
+        renamed first and the references to them in the other files are
+        updated, then BespinMain.js and BespinWorker.js. BespinEmbedded.js
+        and BespinEmbedded.css are where pages start loading Bespin, so
+        they keep their names and get a fingerprinted copy. asset-manifest.json maps each of the original
+        names to the fingerprinted one."""
+        output_dir = self.output_dir
+        t = self.timings.start("fingerprint")
+        assets = {}
 
-    def compress_css(self, compressor):
-        """Compress the CSS using YUI Compressor."""
-        print "Compressing CSS with YUI Compressor"
-        compressor = path(compressor).abspath()
-        subprocess.call("java -jar %s"
-            " --type css -o BespinEmbedded.compressed.css"
-            " BespinEmbedded.css" % compressor, shell=True,
-            cwd=self.output_dir)
-        uncompressed = self.output_dir / "BespinEmbedded.css"
-        compressed = self.output_dir / "BespinEmbedded.compressed.css"
-        if not compressed.exists():
-            raise BuildError("Unable to compress the css file at " + uncompressed)
-        uncompressed.rename(self.output_dir / "BespinEmbedded.uncompressed.css")
-        compressed.rename(uncompressed)
+        def move(f, keep=False):
+            new = fingerprinted_name(f)
+            if keep:
+                f.copyfile(new)
+            else:
+                f.rename(new)
+
+            mapfile = f + ".map"
+            if mapfile.exists():
+                smap = loads(mapfile.text("utf8"))
+                if not keep:
+                    mapfile.remove()
+                _strip_source_map_comment(new, f)
+                write_source_map(new, SourceMap.from_json(smap))
+
+            name = output_dir.relpathto(f).replace("\\", "/")
+            assets[name] = output_dir.relpathto(new).replace("\\", "/")
+            return name, assets[name]
+
+        main_js = output_dir / "BespinMain.js"
+        worker_js = output_dir / "BespinWorker.js"
+        embedded_js = output_dir / "BespinEmbedded.js"
+
+        renames = []
+        for location in self._chunks:
+            chunk_js = output_dir / location
+            renames.append(move(chunk_js))
+            chunk_css = chunk_js.splitext()[0] + ".css"
+            if chunk_css.exists():
+                renames.append(move(chunk_css))
+        for f in [embedded_js, main_js, worker_js]:
+            _replace_references(f, renames)
+
+        renames = [move(main_js), move(worker_js)]
+        _replace_references(embedded_js, renames)
+
+        move(embedded_js, keep=True)
+        move(output_dir / "BespinEmbedded.css", keep=True)
+
+        (output_dir / "asset-manifest.json").write_bytes(
+            dumps(assets, sort_keys=True, indent=4))
+        self._assets = assets
+        self.timings.stop(t)
+        return assets
+
+    def precompress_output(self):
+        """Writes the gzipped (and brotli) copies of the output files for
+        the precompress option. This runs once the output is final, after
+        any compression and fingerprinting, so that each file is only
+        compressed once."""
+        output_dir = self.output_dir
+        files = [ f for f in (sorted(self._created_javascript)
+                              + sorted(self._created_css)) if f.exists() ]
+        if self._assets:
+            files.extend([ output_dir / name
+                           for name in sorted(self._assets.values()) ])
+        for f in files:
+            t = self.timings.start("precompress", f.basename())
+            precompress_file(f)
+            self.timings.stop(t, (f + ".gz").size)
 
 
 def main(args=None):
@@ -500,11 +1247,32 @@ def main(args=None):
         help="path to Closure Compiler to compress the JS output")
     parser.add_option("-c", "--csscompressor", dest="csscompressor",
         help="path to YUI Compressor to compress the CSS output")
+    parser.add_option("-m", "--minify", dest="minify", action="store_true",
+        default=False, help="minify the JS and CSS output with dryice's "
+            "own minifier, where -j or -c isn't given")
     parser.add_option("-D", "--variable", dest="variables",
         action="append",
         help="override values in the manifest (use format KEY=VALUE, where VALUE is JSON)")
     parser.add_option("-s", "--server", dest="server",
         help="starts a server on [address:]port. example: -s 8080")
+    parser.add_option("-w", "--watch", dest="watch", action="store_true",
+        default=False,
+        help="with -s, rebuild in the background when files change "
+             "instead of on every page load")
+    parser.add_option("--timings", dest="timings", metavar="FILE",
+        help="write a JSON report of how long each part of the build "
+             "took to FILE, and print a summary")
+    parser.add_option("--analyze", dest="analyze", metavar="FILE",
+        help="write a report of how much each plugin and module adds to "
+             "the size of the output to FILE (JSON) and an HTML version "
+             "next to it")
+    parser.add_option("--unused", dest="unused", action="store_true",
+        default=False, help="report the plugins and modules that nothing "
+            "in the build uses")
+    parser.add_option("--jobs", dest="jobs", type="int",
+        help="number of processes to use for combining plugins "
+             "and compressing the output (overrides the manifest's "
+             "jobs setting)")
     options, args = parser.parse_args(args)
 
     overrides = {}
@@ -513,6 +1281,9 @@ def main(args=None):
             key, value = setting.split("=")
             overrides[key] = loads(value)
 
+    if options.jobs is not None:
+        overrides["jobs"] = options.jobs
+
     if len(args) > 1:
         filename = args[1]
     else:
@@ -570,8 +1341,65 @@ class DryIceAndWSGI(object):
         self.options = options
         self.overrides = overrides
         
-        manifest = Manifest.from_json(filename.text())
+        manifest = Manifest.from_json(filename.text(), overrides=overrides)
+        self.output_dir = manifest.output_dir
         self.static_app = Cling(manifest.output_dir)
+
+        # the server is threaded, so only one build may run at a time
+        self._build_lock = threading.Lock()
+
+        self.watcher = None
+        if getattr(options, "watch", False):
+            self.build_overrides = dict(overrides)
+            # watch mode rebuilds often, so make those builds incremental
+            if manifest.build_cache is None:
+                cache_dir = self.output_dir + ".cache"
+                self.build_overrides["cache_dir"] = cache_dir
+            else:
+                cache_dir = manifest.build_cache.directory
+            self.rebuild()
+
+            watched = [filename, manifest.loader, manifest.worker,
+                       manifest.boot_file, manifest.preamble]
+            for entry in manifest.search_path:
+                watched.append(entry.get("plugin", entry.get("path")))
+            # what the builds write mustn't set off another build
+            output_dir = self.output_dir
+            exclude = [output_dir, output_dir + ".next",
+                       output_dir + ".old", cache_dir]
+            if manifest.unbundled_plugins:
+                exclude.append(manifest.unbundled_plugins)
+            self.watcher = Watcher(watched, self.rebuild, exclude=exclude)
+            self.watcher.start()
+
+    def rebuild(self):
+        """Builds into a staging directory that is swapped into place when
+        the build succeeds, so that the last good build is always what
+        gets served. The output that was replaced becomes the staging
+        directory for the next build, so that its resources only need to
+        be brought up to date rather than copied all over again."""
+        self._build_lock.acquire()
+        try:
+            try:
+                staging = path(self.output_dir + ".next")
+                overrides = dict(self.build_overrides)
+                overrides["output_dir"] = staging
+                if not do_build(self.filename, self.options, overrides):
+                    return
+                old = path(self.output_dir + ".old")
+                if old.exists():
+                    old.rmtree()
+                if self.output_dir.exists():
+                    self.output_dir.rename(old)
+                staging.rename(self.output_dir)
+                if old.exists():
+                    old.rename(staging)
+                print "Rebuilt %s" % (self.output_dir)
+            except Exception:
+                # keep the watcher alive and serving the last good build
+                traceback.print_exc()
+        finally:
+            self._build_lock.release()
         
     def __call__(self, environ, start_response):
         path_info = environ.get("PATH_INFO", "")
@@ -586,10 +1414,122 @@ class DryIceAndWSGI(object):
                 return ['']
             else:
                 start_response("200 OK", headers)
-                do_build(self.filename, self.options, self.overrides)
+                if self.watcher is None:
+                    self._build_lock.acquire()
+                    try:
+                        do_build(self.filename, self.options, self.overrides)
+                    finally:
+                        self._build_lock.release()
                 return [index_html]
         else:
-            return self.static_app(environ, start_response)
+            return self.serve_static(environ, start_response)
+
+    def serve_static(self, environ, start_response):
+        """Serves a file from the build output. Unlike the static package
+        on its own, this always sends a Content-Length for files, so that
+        the connection can be kept alive for the browser's next request.
+        If the build was precompressed and the client accepts it, the
+        .br or .gz version of the file is sent instead."""
+        path_info = environ.get("PATH_INFO", "")
+        filename = self.output_dir / path_info.lstrip("/")
+        content_encoding = None
+
+        accepted = accepted_encodings(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        for encoding, ext in (("br", ".br"), ("gzip", ".gz")):
+            if encoding in accepted and (filename + ext).isfile():
+                environ = dict(environ)
+                environ["PATH_INFO"] = path_info + ext
+                content_type = (mimetypes.guess_type(filename)[0]
+                                or "text/plain")
+                filename = filename + ext
+                content_encoding = encoding
+                break
+
+        def start_with_length(status, headers, exc_info=None):
+            names = [name.lower() for name, value in headers]
+            if status.startswith("200") and "content-length" not in names \
+                and filename.isfile():
+                headers.append(("Content-Length", str(filename.size)))
+            if content_encoding:
+                headers = [(name, value) for name, value in headers
+                           if name.lower() != "content-type"]
+                headers.append(("Content-Type", content_type))
+                headers.append(("Content-Encoding", content_encoding))
+                headers.append(("Vary", "Accept-Encoding"))
+            return start_response(status, headers, exc_info)
+
+        return self.static_app(environ, start_with_length)
+
+def accepted_encodings(header):
+    """Returns the set of content codings that an Accept-Encoding header
+    allows."""
+    result = set()
+    for item in header.split(","):
+        parts = item.strip().split(";")
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            name, sep, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            result.add(coding)
+    return result
+
+class ThreadingWSGIServer(SocketServer.ThreadingMixIn, WSGIServer):
+    """A WSGIServer that handles each connection in its own thread, so
+    that the browser's parallel requests are not queued up behind each
+    other (or behind a build)."""
+    daemon_threads = True
+
+class KeepAliveServerHandler(ServerHandler):
+    http_version = "1.1"
+
+    def cleanup_headers(self):
+        ServerHandler.cleanup_headers(self)
+        if "Content-Length" not in self.headers \
+            and not self.status[:3] in ("204", "304"):
+            # without a length, the client can only find the end of the
+            # response by the connection closing
+            self.headers["Connection"] = "close"
+            self.request_handler.close_connection = 1
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """Handles HTTP/1.1 requests, keeping the connection open between
+    requests."""
+    protocol_version = "HTTP/1.1"
+
+    # idle keep-alive connections are dropped after this many seconds
+    timeout = 30
+
+    def handle(self):
+        # skip WSGIRequestHandler's single request version
+        BaseHTTPRequestHandler.handle(self)
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline()
+        except socket.timeout:
+            self.close_connection = 1
+            return
+        if not self.raw_requestline:
+            self.close_connection = 1
+            return
+        if not self.parse_request():
+            return
+
+        handler = KeepAliveServerHandler(
+            self.rfile, self.wfile, self.get_stderr(), self.get_environ()
+        )
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+        self.wfile.flush()
+
 
 def start_server(filename, options, overrides):
     """Starts the little webserver"""
@@ -603,21 +1543,56 @@ def start_server(filename, options, overrides):
     port = int(port)
     print "Server started on %s, port %s" % (host, port)
     try:
-        make_server(host, port, app).serve_forever()
+        make_server(host, port, app, server_class=ThreadingWSGIServer,
+            handler_class=KeepAliveRequestHandler).serve_forever()
     except KeyboardInterrupt:
         pass
     
 def do_build(filename, options, overrides):
-    """Runs the actual build"""
+    """Runs the actual build. Returns True if the build succeeded."""
     try:
         manifest = Manifest.from_json(filename.text(), overrides=overrides)
+
+        # the size report needs source maps to see through the compression
+        minify = getattr(options, "minify", False)
+        if getattr(options, "analyze", None) and not manifest.source_maps \
+                and (options.jscompressor or minify):
+            print ("Turning on source_maps for the size report: the output "
+                   "will include .map files and point to them")
+            manifest.source_maps = True
+
+        manifest.report_unused = getattr(options, "unused", False)
         manifest.build()
 
         if options.jscompressor:
             manifest.compress_js(options.jscompressor)
+        elif minify:
+            manifest.compress_js()
 
         if options.csscompressor:
             manifest.compress_css(options.csscompressor)
+        elif minify:
+            manifest.compress_css()
+
+        if getattr(options, "analyze", None):
+            t = manifest.timings.start("analyze")
+            report = analyze.analyze(manifest)
+            html_file = analyze.write_report(report, options.analyze)
+            manifest.timings.stop(t)
+            print "Size report written to %s and %s" % (options.analyze,
+                                                         html_file)
+
+        if manifest.fingerprint:
+            manifest.fingerprint_output()
+
+        if manifest.precompress:
+            manifest.precompress_output()
+
+        if getattr(options, "timings", None):
+            manifest.timings.write(options.timings)
+            print manifest.timings.summary()
     except BuildError, e:
         print "Build aborted: %s" % (e)
+        return False
+    return True
 
@@ -0,0 +1,210 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+"""Finds the plugins and modules in a build that nothing uses, by
+following the require() calls in the code and the pointers in the plugin
+metadata from the plugins that the manifest asks for."""
+
+import re
+import posixpath
+
+_require = re.compile(r"""\brequire\(\s*(['"])([^'"]+)\1\s*\)""")
+# require() of something other than a string literal, which can't be
+# followed
+_dynamic_require = re.compile(r"""\brequire\(\s*[^'"\s)]""")
+_ensure_package = re.compile(r"""\bensurePackage\(\s*(['"])(?:::)?([^'"]+)\1""")
+# strings like "syntax_worker#syntaxWorker", which are pointers that are
+# followed at runtime (WorkerSupervisor takes one, for example)
+_string_pointer = re.compile(r"""(['"])([\w$./:-]+)#[\w$.]+\1""")
+
+class PluginInfo(object):
+    """What find_unused needs to know about a plugin: its metadata, the
+    source of each of its modules (by module name) and whether it has
+    CSS."""
+
+    def __init__(self, metadata, modules, has_css=False):
+        self.metadata = metadata or {}
+        self.modules = modules
+        self.has_css = has_css
+
+def module_name(plugin_name, source):
+    """Returns the module name for a source name reported by
+    combiner.combine_files."""
+    prefix = plugin_name + "/"
+    if source.startswith(prefix):
+        return posixpath.splitext(source[len(prefix):])[0]
+    # a single file plugin
+    return "index"
+
+def split_modules(plugin_name, js, segments):
+    """Returns a dictionary of module name to source, given a plugin's
+    combined JavaScript and the segments that combine_files reported."""
+    lines = js.split("\n")
+    modules = {}
+    for source, filename, line, count in segments:
+        modules[module_name(plugin_name, source)] = \
+            "\n".join(lines[line:line + count])
+    return modules
+
+def pointers(metadata):
+    """Yields each of the "pointer" values in a plugin's metadata."""
+    if isinstance(metadata, dict):
+        for key, value in metadata.items():
+            if key == "pointer" and isinstance(value, basestring):
+                yield value
+            else:
+                for pointer in pointers(value):
+                    yield pointer
+    elif isinstance(metadata, list):
+        for value in metadata:
+            for pointer in pointers(value):
+                yield pointer
+
+def resolve(plugins, plugin, module, id):
+    """Returns the "plugin:module" that require(id) refers to in the given
+    module of plugin, or None if it isn't part of the build."""
+    if ":" in id:
+        if id.startswith("::"):
+            return "%s:index" % id[2:]
+        other, other_module = id.split(":", 1)
+        return "%s:%s" % (other or plugin, other_module or "index")
+    if id.startswith("./") or id.startswith("../"):
+        return "%s:%s" % (plugin, posixpath.normpath(
+            posixpath.join(posixpath.dirname(module), id)))
+    if plugin in plugins and id in plugins[plugin].modules:
+        return "%s:%s" % (plugin, id)
+    if id in plugins:
+        return "%s:index" % id
+    first, rest = (id.split("/", 1) + [""])[:2]
+    if first in plugins and rest:
+        return "%s:%s" % (first, rest)
+    return None
+
+def _pointer_module(plugin, pointer):
+    module = pointer.split("#", 1)[0]
+    if ":" in module:
+        return module
+    return "%s:%s" % (plugin, module or "index")
+
+def find_unused(plugins, roots, scripts=()):
+    """Works out what is unused. plugins is a dictionary of plugin name to
+    PluginInfo, roots are the names of the plugins the manifest asks for
+    and scripts are the other bits of JavaScript on the page (such as the
+    boot script) that may require modules.
+
+    A plugin is used if it is a root, provides anything through its
+    metadata, has CSS or has a module that is used. Modules that can be
+    reached through require(), a metadata pointer or a "plugin#export"
+    string are used, and a module that calls require() with something
+    other than a string makes all of its plugin's modules count as used.
+    The "index" module of each plugin that a used plugin depends on is
+    used too, as the plugin may be loaded through its dependencies.
+    The "index" and "templates" modules and test modules are never
+    reported.
+
+    Returns the sorted list of unused plugins and a dictionary of plugin
+    name to the sorted list of its unused modules, for the other
+    plugins."""
+    to_visit = [ "%s:index" % name for name in roots ]
+    for name, info in plugins.items():
+        for pointer in pointers(info.metadata):
+            to_visit.append(_pointer_module(name, pointer))
+    for script in scripts:
+        for match in _require.finditer(script):
+            if ":" in match.group(2):
+                to_visit.append(resolve(plugins, None, "", match.group(2)))
+        for match in _ensure_package.finditer(script):
+            to_visit.append("%s:index" % match.group(2))
+
+    roots = set(roots)
+    reached = set()
+
+    def is_used(name, info):
+        prefix = name + ":"
+        if name in roots or info.metadata.get("provides") or info.has_css \
+                or prefix + "index" in reached:
+            return True
+        for module in info.modules:
+            if prefix + module in reached:
+                return True
+        return False
+
+    while to_visit:
+        while to_visit:
+            module_id = to_visit.pop()
+            if module_id is None or module_id in reached:
+                continue
+            reached.add(module_id)
+            plugin, module = module_id.split(":", 1)
+            info = plugins.get(plugin)
+            if info is None:
+                continue
+            source = info.modules.get(module)
+            if source is None:
+                continue
+            for match in _require.finditer(source):
+                to_visit.append(resolve(plugins, plugin, module,
+                                        match.group(2)))
+            for match in _string_pointer.finditer(source):
+                to_visit.append(resolve(plugins, plugin, module,
+                                        match.group(2)))
+            if _dynamic_require.search(source):
+                to_visit.extend([ "%s:%s" % (plugin, other)
+                                  for other in info.modules ])
+
+        for name, info in plugins.items():
+            if not is_used(name, info):
+                continue
+            for dep in info.metadata.get("dependencies") or {}:
+                if dep in plugins and "%s:index" % dep not in reached:
+                    to_visit.append("%s:index" % dep)
+
+    unused_plugins = []
+    unused_modules = {}
+    for name, info in plugins.items():
+        prefix = name + ":"
+        if not is_used(name, info):
+            unused_plugins.append(name)
+            continue
+        unused = [ module for module in info.modules
+                   if prefix + module not in reached
+                   and module not in ("index", "templates")
+                   and "tests" not in module.split("/") ]
+        if unused:
+            unused_modules[name] = sorted(unused)
+    unused_plugins.sort()
+    return unused_plugins, unused_modules
@@ -0,0 +1,166 @@
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+#
+# The contents of this file are subject to the Mozilla Public License Version
+# 1.1 (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License
+# for the specific language governing rights and limitations under the
+# License.
+#
+# The Original Code is Bespin.
+#
+# The Initial Developer of the Original Code is
+# Mozilla.
+# Portions created by the Initial Developer are Copyright (C) 2009
+# the Initial Developer. All Rights Reserved.
+#
+# Contributor(s):
+#
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+#
+# ***** END LICENSE BLOCK *****
+
+
+"""Watches plugin directories for changes so that the dryice server can
+rebuild in the background."""
+
+import os
+import time
+import threading
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+from dryice.path import path
+
+def _is_excluded(name, exclude):
+    for directory in exclude:
+        if name == directory or name.startswith(directory + os.sep):
+            return True
+    return False
+
+def snapshot(paths, exclude=()):
+    """Returns a dictionary mapping every file and directory under paths to
+    its size and modification time. Whatever is in the directories in
+    exclude (which must be absolute) is left out."""
+    result = {}
+    for p in paths:
+        p = path(p)
+        if not p.exists() or _is_excluded(p, exclude):
+            continue
+        if not p.isdir():
+            st = p.stat()
+            result[p] = (st.st_size, st.st_mtime)
+            continue
+        for dirpath, dirnames, filenames in os.walk(p):
+            dirnames[:] = [ name for name in dirnames if not _is_excluded(
+                            os.path.join(dirpath, name), exclude) ]
+            for name in dirnames + filenames:
+                fullname = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(fullname)
+                except OSError:
+                    # deleted while we were looking
+                    continue
+                result[fullname] = (st.st_size, st.st_mtime)
+    return result
+
+class Watcher(object):
+    """Calls callback from a background thread whenever one of the files
+    or directories in paths changes. Changes are noticed with inotify
+    when pyinotify is installed, otherwise by polling every interval
+    seconds. Bursts of changes (such as an editor saving several files)
+    are reported with a single call. Changes in the directories in
+    exclude are ignored, so that a build's output can sit inside a
+    watched directory without every build setting off another."""
+
+    def __init__(self, paths, callback, interval=1.0, use_inotify=True,
+                 exclude=()):
+        self.paths = [path(p).abspath() for p in paths]
+        self.exclude = [path(p).abspath() for p in exclude]
+        self.callback = callback
+        self.interval = interval
+        self.use_inotify = use_inotify and pyinotify is not None
+        self._changed = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._notifier = None
+
+    def start(self):
+        if self.use_inotify:
+            self._start_inotify()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._changed.set()
+        if self._notifier is not None:
+            self._notifier.stop()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _start_inotify(self):
+        changed = self._changed
+        exclude = self.exclude
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                if not _is_excluded(event.pathname, exclude):
+                    changed.set()
+
+        mask = (pyinotify.IN_MODIFY | pyinotify.IN_CREATE
+                | pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM
+                | pyinotify.IN_MOVED_TO | pyinotify.IN_ATTRIB)
+        wm = pyinotify.WatchManager()
+        self._notifier = pyinotify.ThreadedNotifier(wm, Handler())
+        self._notifier.setDaemon(True)
+        self._notifier.start()
+        for p in self.paths:
+            if p.exists():
+                wm.add_watch(p, mask, rec=True, auto_add=True,
+                    exclude_filter=lambda name: _is_excluded(name, exclude))
+
+    def _wait_for_change(self, last):
+        """Blocks until something changes. Returns the new snapshot when
+        polling."""
+        if self.use_inotify:
+            self._changed.wait()
+            # let the rest of a burst of events arrive
+            time.sleep(self.interval / 4.0)
+            self._changed.clear()
+            return None
+
+        while not self._stopped.isSet():
+            self._stopped.wait(self.interval)
+            current = snapshot(self.paths, self.exclude)
+            if current != last:
+                return current
+        return last
+
+    def _run(self):
+        last = None
+        if not self.use_inotify:
+            last = snapshot(self.paths, self.exclude)
+        while not self._stopped.isSet():
+            last = self._wait_for_change(last)
+            if self._stopped.isSet():
+                break
+            self.callback()